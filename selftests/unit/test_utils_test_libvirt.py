@@ -0,0 +1,324 @@
+#!/usr/bin/python
+
+import os
+import unittest
+import sys
+
+from avocado.core import exceptions
+
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, 'virttest')):
+    sys.path.append(basedir)
+
+from virttest.unittest_utils import mock
+from virttest.utils_test import libvirt
+
+
+class TestCpusParser(unittest.TestCase):
+
+    def test_single_cpu(self):
+        self.assertEqual(libvirt.cpus_parser("7"), [7])
+        self.assertEqual(libvirt.cpus_parser(" 3 "), [3])
+
+    def test_none(self):
+        self.assertEqual(libvirt.cpus_parser(None), None)
+
+    def test_range(self):
+        self.assertEqual(libvirt.cpus_parser("0-3"), [0, 1, 2, 3])
+
+    def test_range_with_whitespace(self):
+        self.assertEqual(libvirt.cpus_parser("1 - 3"), [1, 2, 3])
+        self.assertEqual(libvirt.cpus_parser("0, 2"), [0, 2])
+
+    def test_exclusion(self):
+        self.assertEqual(libvirt.cpus_parser("0-3,^2"), [0, 1, 3])
+        self.assertEqual(libvirt.cpus_parser("2-4,^3,7"), [2, 4, 7])
+
+    def test_mixed(self):
+        self.assertEqual(libvirt.cpus_parser("1,3-4"), [1, 3, 4])
+
+    def test_empty_item(self):
+        self.assertEqual(libvirt.cpus_parser("1,,2"), [1, 2])
+
+    def test_only_exclusion(self):
+        # Used to raise ValueError, nothing is left to return
+        self.assertEqual(libvirt.cpus_parser("^2"), [])
+
+
+class TestIsValidCpusString(unittest.TestCase):
+
+    def test_valid(self):
+        for cpus in ("0", "0,1-2,^3", " 1, 2"):
+            self.assertTrue(libvirt._is_valid_cpus_string(cpus), cpus)
+
+    def test_invalid(self):
+        for cpus in ("r", "1-", "0-", "a", "", "^", "1-2-3"):
+            self.assertFalse(libvirt._is_valid_cpus_string(cpus), cpus)
+
+
+class TestGenerateDisksIndex(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(libvirt._generate_disks_index(0), [])
+
+    def test_first_letters(self):
+        self.assertEqual(libvirt._generate_disks_index(3),
+                         ["vda", "vdb", "vdc"])
+
+    def test_two_letters(self):
+        targets = libvirt._generate_disks_index(53)
+        self.assertEqual(targets[25], "vdz")
+        self.assertEqual(targets[26], "vdaa")
+        self.assertEqual(targets[51], "vdaz")
+        self.assertEqual(targets[52], "vdba")
+
+    def test_three_letters(self):
+        targets = libvirt._generate_disks_index(703)
+        self.assertEqual(targets[701], "vdzz")
+        self.assertEqual(targets[702], "vdaaa")
+        self.assertEqual(len(set(targets)), 703)
+
+    def test_bus_prefix(self):
+        self.assertEqual(libvirt._generate_disks_index(27, "scsi")[26],
+                         "sdaa")
+        self.assertEqual(libvirt._generate_disks_index(1, "ide"), ["hda"])
+
+    def test_unknown_bus(self):
+        self.assertRaises(exceptions.TestError,
+                          libvirt._generate_disks_index, 1, "usb")
+
+
+class FakePartedSession(object):
+
+    """
+    Session returning a canned 'parted print' and recording other commands
+    """
+
+    def __init__(self, print_output):
+        self.print_output = print_output
+        self.cmds = []
+
+    def get_command_output(self, cmd):
+        if cmd.endswith(" print"):
+            return self.print_output
+        self.cmds.append(cmd)
+        return ""
+
+
+class TestMkPart(unittest.TestCase):
+
+    rows = [" 1      1049kB  106MB   105MB   primary\n",
+            " 2      106MB   211MB   105MB   primary\n",
+            " 3      211MB   316MB   105MB   primary\n"]
+
+    @staticmethod
+    def parted_print(label, rows=()):
+        return ("Model: ATA QEMU HARDDISK (scsi)\n"
+                "Disk /dev/sdb: 10.7GB\n"
+                "Sector size (logical/physical): 512B/512B\n"
+                "Partition Table: %s\n"
+                "Disk Flags: \n"
+                "\n"
+                "Number  Start   End     Size    Type     File system  Flags\n"
+                "%s\n" % (label, "".join(rows)))
+
+    def mk_part(self, print_output, size):
+        session = FakePartedSession(print_output)
+        libvirt.mk_part("/dev/sdb", size, "ext4", session=session)
+        return session.cmds
+
+    def test_unknown_label(self):
+        self.assertEqual(self.mk_part(self.parted_print("unknown"), "100M"),
+                         ["parted -s -a optimal /dev/sdb mklabel msdos "
+                          "mkpart primary ext4 0 100.0"])
+
+    def test_unsupported_label(self):
+        self.assertEqual(self.mk_part(self.parted_print("loop"), "100M"), [])
+
+    def test_after_existing_parts(self):
+        self.assertEqual(
+            self.mk_part(self.parted_print("msdos", self.rows[:2]), "100M"),
+            ["parted -s -a optimal /dev/sdb mkpart primary ext4 211MB 311.0"])
+
+    def test_file_system_column(self):
+        # A file system name ending in a digit must not count as a row
+        rows = [row.rstrip("\n") + "  ext4\n" for row in self.rows[:2]]
+        self.assertEqual(
+            self.mk_part(self.parted_print("msdos", rows), "100M"),
+            ["parted -s -a optimal /dev/sdb mkpart primary ext4 211MB 311.0"])
+
+    def test_msdos_extended(self):
+        # The extended partition ends at the full disk size, not "10"
+        self.assertEqual(
+            self.mk_part(self.parted_print("msdos", self.rows), "100M"),
+            ["parted -s -a optimal /dev/sdb mkpart extended 316MB 10.7GB "
+             "mkpart logical ext4 316MB 416.0"])
+
+    def test_size_list(self):
+        self.assertEqual(
+            self.mk_part(self.parted_print("gpt"), ["100M", "200M"]),
+            ["parted -s -a optimal /dev/sdb mkpart primary ext4 0 100.0 "
+             "mkpart primary ext4 100.0MB 300.0"])
+
+    def test_size_list_unknown_label(self):
+        # The new msdos label needs the extended partition as well
+        self.assertEqual(
+            self.mk_part(self.parted_print("unknown"),
+                         ["100M", "100M", "100M", "100M", "100M"]),
+            ["parted -s -a optimal /dev/sdb mklabel msdos "
+             "mkpart primary ext4 0 100.0 "
+             "mkpart primary ext4 100.0MB 200.0 "
+             "mkpart primary ext4 200.0MB 300.0 "
+             "mkpart extended 300.0MB 10.7GB "
+             "mkpart logical ext4 300.0MB 400.0 "
+             "mkpart logical ext4 400.0MB 500.0"])
+
+    def test_size_list_msdos_extended(self):
+        # Same partitions as two single calls, in one parted command
+        self.assertEqual(
+            self.mk_part(self.parted_print("msdos", self.rows[:2]),
+                         ["100M", "200M"]),
+            ["parted -s -a optimal /dev/sdb "
+             "mkpart primary ext4 211MB 311.0 "
+             "mkpart extended 311.0MB 10.7GB "
+             "mkpart logical ext4 311.0MB 511.0"])
+
+
+class TestParsePciId(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(libvirt._parse_pci_id("0000:06:00.1"),
+                         {'domain': '0x0000', 'bus': '0x06',
+                          'slot': '0x00', 'function': '0x1'})
+        self.assertEqual(libvirt._parse_pci_id("ffff:ff:1f.7"),
+                         {'domain': '0xffff', 'bus': '0xff',
+                          'slot': '0x1f', 'function': '0x7'})
+
+    def test_invalid(self):
+        # The old split based parsing accepted most of these silently
+        for pci_id in ("0000:06:00", "06:00.1", "0000:06:00.1x",
+                       "0000.06.00.1", ""):
+            self.assertRaises(exceptions.TestError,
+                              libvirt._parse_pci_id, pci_id)
+
+
+class FakeCmdResult(object):
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+
+class TestGetInterfaceDetails(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god(ut=self)
+
+    def tearDown(self):
+        self.god.unstub_all()
+
+    def get_details(self, output):
+        self.god.stub_with(libvirt.virsh, 'domiflist',
+                           lambda vm_name: FakeCmdResult(output))
+        return libvirt.get_interface_details("vm1")
+
+    def test_rows(self):
+        output = ("Interface  Type       Source     Model       MAC\n"
+                  "-------------------------------------------------------\n"
+                  "vnet0      bridge     virbr0     virtio      "
+                  "52:54:00:b2:b3:b4\n"
+                  "-          network    default    e1000       "
+                  "52:54:00:AA:bb:0c\n"
+                  "\n")
+        self.assertEqual(self.get_details(output),
+                         [{'interface': 'vnet0', 'type': 'bridge',
+                           'source': 'virbr0', 'model': 'virtio',
+                           'mac': '52:54:00:b2:b3:b4'},
+                          {'interface': '-', 'type': 'network',
+                           'source': 'default', 'model': 'e1000',
+                           'mac': '52:54:00:AA:bb:0c'}])
+
+    def test_indented_rows(self):
+        # Newer virsh indents the table, the old regex found no rows then
+        output = (" Interface   Type      Source   Model    MAC\n"
+                  "-------------------------------------------------\n"
+                  " vnet1       network   my-net   virtio   "
+                  "52:54:00:00:00:01\n")
+        self.assertEqual(self.get_details(output),
+                         [{'interface': 'vnet1', 'type': 'network',
+                           'source': 'my-net', 'model': 'virtio',
+                           'mac': '52:54:00:00:00:01'}])
+
+    def test_no_interface(self):
+        output = ("Interface  Type       Source     Model       MAC\n"
+                  "-------------------------------------------------------\n"
+                  "\n")
+        self.assertEqual(self.get_details(output), [])
+
+
+
+class TestGetIfnameHost(unittest.TestCase):
+
+    output = (" Interface   Type      Source   Model    MAC\n"
+              "-------------------------------------------------\n"
+              " vnet0       bridge    virbr0   virtio   52:54:00:b2:b3:b4\n"
+              " vnet1       network   default  e1000    52:54:00:b2:b3:b40\n")
+
+    def setUp(self):
+        self.god = mock.mock_god(ut=self)
+        self.god.stub_with(libvirt.virsh, 'domiflist',
+                           lambda vm_name: FakeCmdResult(self.output))
+
+    def tearDown(self):
+        self.god.unstub_all()
+
+    def test_indented_row(self):
+        self.assertEqual(libvirt.get_ifname_host("vm1", "52:54:00:b2:b3:b4"),
+                         "vnet0")
+
+    def test_not_found(self):
+        # A MAC that is only a prefix of another one must not match
+        self.assertEqual(libvirt.get_ifname_host("vm1", "52:54:00:b2:b3:b"),
+                         None)
+        self.assertEqual(libvirt.get_ifname_host("vm1", "52:54:00:00:00:01"),
+                         None)
+
+
+
+class TestVirshCmdHasOption(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god(ut=self)
+        self.calls = []
+        self.god.stub_with(libvirt.virsh, 'has_command_help_match',
+                           self.help_match)
+        libvirt.clear_virsh_cmd_option_cache()
+
+    def tearDown(self):
+        self.god.unstub_all()
+        libvirt.clear_virsh_cmd_option_cache()
+
+    def help_match(self, cmd, option):
+        self.calls.append((cmd, option))
+        return option == "--live"
+
+    def test_cache_hit(self):
+        for _ in range(3):
+            self.assertTrue(libvirt.virsh_cmd_has_option("setvcpus",
+                                                         "--live"))
+            self.assertFalse(libvirt.virsh_cmd_has_option("setvcpus",
+                                                          "--foo",
+                                                          raise_skip=False))
+        self.assertEqual(self.calls, [("setvcpus", "--live"),
+                                      ("setvcpus", "--foo")])
+
+    def test_clear(self):
+        libvirt.virsh_cmd_has_option("setvcpus", "--live")
+        libvirt.clear_virsh_cmd_option_cache()
+        libvirt.virsh_cmd_has_option("setvcpus", "--live")
+        self.assertEqual(self.calls, [("setvcpus", "--live")] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,10 @@
+from __future__ import print_function
+
 __author__ = "raphtee@google.com (Travis Miller)"
 
 import collections
 import re
 import sys
-from __future__ import print_function
 
 import six
 from six import StringIO
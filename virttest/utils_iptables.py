@@ -3,6 +3,8 @@ Library to perform iptables configuration for virt test.
 """
 import logging
 
+from six.moves import shlex_quote
+
 from avocado.utils import process
 from avocado.core import exceptions
 
@@ -16,15 +18,17 @@ class Iptables(object):
 
     @classmethod
     def setup_or_cleanup_iptables_rules(cls, rules, params=None,
-                                        cleanup=False):
+                                        cleanup=False, atomic=False):
         """
         Setup or cleanup for iptable rules, it can be locally or remotely
 
         :param rules: list of rules
         :param params: dict with server details
         :param cleanup: Boolean value, true to cleanup, false to setup
+        :param atomic: Boolean value, true to apply all rules in one
+                       iptables-restore transaction
         """
-        commands = []
+        actions = []
         # check the existing iptables rules in remote or local machine
         iptable_check_cmd = "iptables -S"
         if params:
@@ -58,10 +62,29 @@ class Iptables(object):
                     flag = True
                     if cleanup:
                         logging.debug("cleaning rule: %s", rule)
-                        commands.append("iptables -D %s" % rule)
+                        actions.append("-D %s" % rule)
             if not flag and not cleanup:
                 logging.debug("Adding rule: %s", rule)
-                commands.append("iptables -I %s" % rule)
+                actions.append("-I %s" % rule)
+        commands = ["iptables %s" % action for action in actions]
+        if atomic and actions:
+            # Apply all the filtered rules in a single iptables-restore batch,
+            # kept on one line so a remote shell never shows its PS2 prompt
+            lines = ["*filter"] + actions + ["COMMIT"]
+            batch_cmd = ("printf '%%s\\n' %s | iptables-restore --noflush"
+                         % " ".join(shlex_quote(line) for line in lines))
+            if params:
+                status = server_session.cmd_status(batch_cmd)
+            else:
+                status = process.run(batch_cmd, shell=True,
+                                     ignore_status=True).exit_status
+            if status == 0:
+                logging.debug("iptable command success %s", batch_cmd)
+                commands = []
+            else:
+                # The batch is all-or-nothing, one stale rule rejects it
+                logging.debug("iptables-restore batch failed, applying the "
+                              "rules one by one")
         # Once rules are filtered, then it is executed in remote or local
         # machine
         for command in commands:
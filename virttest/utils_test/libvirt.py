@@ -19,6 +19,8 @@ More specifically:
 import re
 import os
 import ast
+import errno
+import json
 import logging
 import shutil
 import threading
@@ -26,6 +28,7 @@ import time
 import sys
 import aexpect
 
+from operator import itemgetter
 from avocado.core import exceptions
 from avocado.utils import path as utils_path
 from avocado.utils import process
@@ -34,6 +37,12 @@ from avocado.utils import linux_modules
 from avocado.utils import distro
 
 import six
+from six.moves import shlex_quote
+
+try:
+    import selinux
+except ImportError:
+    selinux = None
 
 from .. import virsh
 from .. import xml_utils
@@ -67,6 +76,43 @@ from ..libvirt_xml.devices import channel
 
 ping = utils_net.ping
 
+_IS_UBUNTU = distro.detect().name == 'Ubuntu'
+
+_RE_BANDWIDTH = re.compile(r'(\d+) (\w+)/s')
+_RE_PROCESSOR = re.compile("processor")
+# "major minor #blocks name" rows of /proc/partitions
+_RE_PARTS = re.compile(r"^\s*\d+\s+\d+\s+\d+\s+(\S+)\s*$", re.M)
+_RE_MAC = re.compile(r"[a-fA-F0-9]{2}(?::[a-fA-F0-9]{2}){5}$")
+# virsh iface-list columns: name, state and MAC address
+_RE_IFACE_LIST = re.compile(r"(\S+)\ +(\S+)\ +(\S+|\s+)[\ +\n]")
+# "key=value" attribute of an nwfilter rule, split at the first '='
+_RE_RULE_ATTR = re.compile(r"([^\s=]+)=(\S*)")
+# Results of virsh_cmd_has_option, keyed by (command, option)
+_VIRSH_CMD_OPTIONS = {}
+# Last get_iothreadsinfo results: (vm_name, options) -> (time, info dict)
+_IOTHREADS_INFO_CACHE = {}
+_CONSOLE_PATTERNS = [r"[Ee]scape character is", r"login:", r"[Pp]assword:"]
+
+_SUPPORTED_DISK_LABELS = frozenset(('unknown', 'gpt', 'msdos'))
+# Usage types create_secret knows how to fill in, in display order
+_SECRET_USAGE_TYPES = ('volume', 'ceph', 'iscsi', 'tls')
+
+# Option forcing mkfs.<fs_type> to overwrite an existing file system
+_MKFS_FORCE_OPTIONS = {'ext2': '-F', 'ext3': '-F', 'ext4': '-F', 'ntfs': '-F',
+                       'fat': '-I', 'vfat': '-I', 'msdos': '-I',
+                       'xfs': '-f', 'btrfs': '-f'}
+
+# Max number of volumes deleted concurrently when cleaning up a pool
+_MAX_PARALLEL_VOL_DELETE = 8
+# Max number of disk images created concurrently by attach_disks
+_MAX_PARALLEL_DISK_CREATE = 8
+
+_PCI_ADDRESS_KEYS = itemgetter('domain', 'bus', 'slot', 'function')
+_PCI_LABEL_FMT = "pci_%04x_%02x_%02x_%01x"
+# PCI id such as "0000:03:04.0": domain, bus, slot and function
+_RE_PCI_ID = re.compile(r"([0-9a-fA-F]+):([0-9a-fA-F]+):([0-9a-fA-F]+)"
+                        r"\.([0-9a-fA-F]+)$")
+
 
 class LibvirtNetwork(object):
 
@@ -74,6 +120,11 @@ class LibvirtNetwork(object):
     Class to create a temporary network for testing.
     """
 
+    # Map of supported network type to the method creating its XML
+    _CREATORS = {'vnet': 'create_vnet_xml',
+                 'macvtap': 'create_macvtap_xml',
+                 'bridge': 'create_bridge_xml'}
+
     def create_vnet_xml(self):
         """
         Create XML for a virtual network.
@@ -86,7 +137,7 @@ class LibvirtNetwork(object):
         ip = IPXML(address=address)
         dhcp_start = self.kwargs.get('dhcp_start')
         dhcp_end = self.kwargs.get('dhcp_end')
-        if all([dhcp_start, dhcp_end]):
+        if dhcp_start and dhcp_end:
             ip.dhcp_ranges = {'start': dhcp_start, 'end': dhcp_end}
         net_xml.ip = ip
         return address, net_xml
@@ -127,15 +178,11 @@ class LibvirtNetwork(object):
             self.name = net_name
         self.persistent = kwargs.get('persistent', False)
 
-        if net_type == 'vnet':
-            self.ip, net_xml = self.create_vnet_xml()
-        elif net_type == 'macvtap':
-            self.ip, net_xml = self.create_macvtap_xml()
-        elif net_type == 'bridge':
-            self.ip, net_xml = self.create_bridge_xml()
-        else:
+        creator = self._CREATORS.get(net_type)
+        if creator is None:
             raise exceptions.TestError(
                 'Unknown libvirt network type %s' % net_type)
+        self.ip, net_xml = getattr(self, creator)()
         if self.persistent:
             net_xml.define()
             net_xml.start()
@@ -157,47 +204,50 @@ def cpus_parser(cpulist):
     with '-' for ranges and '^' denotes exclusive.
     :param cpulist: a list of physical CPU numbers
     """
+    if cpulist is None:
+        return None
+    # Fast path for the common single cpu case
+    if cpulist.strip().isdigit():
+        return [int(cpulist)]
+
     hyphens = []
     carets = []
     commas = []
-    others = []
-
-    if cpulist is None:
-        return None
+    for cpus in cpulist.split(","):
+        cpus = cpus.strip()
+        if not cpus:
+            continue
+        if cpus[0] == "^":
+            carets.append(int(cpus[1:]))
+            continue
+        start, sep, end = cpus.partition("-")
+        if sep:
+            hyphens.extend(range(int(start), int(end) + 1))
+            continue
+        try:
+            commas.append(int(cpus))
+        except ValueError:
+            logging.error("The cpulist has to be an "
+                          "integer. (%s)", cpus)
 
-    else:
-        if "," in cpulist:
-            cpulist_list = re.split(",", cpulist)
-            for cpulist in cpulist_list:
-                if "-" in cpulist:
-                    tmp = re.split("-", cpulist)
-                    hyphens = hyphens + list(range(int(tmp[0]), int(tmp[-1]) + 1))
-                elif "^" in cpulist:
-                    tmp = re.split("\^", cpulist)[-1]
-                    carets.append(int(tmp))
-                else:
-                    try:
-                        commas.append(int(cpulist))
-                    except ValueError:
-                        logging.error("The cpulist has to be an "
-                                      "integer. (%s)", cpulist)
-        elif "-" in cpulist:
-            tmp = re.split("-", cpulist)
-            hyphens = list(range(int(tmp[0]), int(tmp[-1]) + 1))
-        elif "^" in cpulist:
-            tmp = re.split("^", cpulist)[-1]
-            carets.append(int(tmp))
-        else:
-            try:
-                others.append(int(cpulist))
-                return others
-            except ValueError:
-                logging.error("The cpulist has to be an "
-                              "integer. (%s)", cpulist)
+    cpus_set = set(hyphens).union(commas).difference(carets)
+    return sorted(cpus_set)
 
-        cpus_set = set(hyphens).union(set(commas)).difference(set(carets))
 
-        return sorted(list(cpus_set))
+def _is_valid_cpus_string(cpus_string):
+    """
+    Check cpus_string is a comma separated list of 'N', 'N-M' or '^N'.
+    """
+    for cpus in cpus_string.split(","):
+        cpus = cpus.strip()
+        if cpus.startswith("^"):
+            if not cpus[1:].isdigit():
+                return False
+            continue
+        start, sep, end = cpus.partition("-")
+        if not start.isdigit() or (sep and not end.isdigit()):
+            return False
+    return True
 
 
 def cpus_string_to_affinity_list(cpus_string, num_cpus):
@@ -212,54 +262,90 @@ def cpus_string_to_affinity_list(cpus_string, num_cpus):
     0-2,^2  -->     [y,y,-,-]
     r       -->     [y,y,y,y]
     """
-    # Check the input string.
-    single_pattern = r"\d+"
-    between_pattern = r"\d+-\d+"
-    exclude_pattern = r"\^\d+"
-    sub_pattern = r"(%s)|(%s)|(%s)" % (exclude_pattern,
-                                       single_pattern, between_pattern)
-    pattern = r"^((%s),)*(%s)$" % (sub_pattern, sub_pattern)
-    if not re.match(pattern, cpus_string):
-        logging.debug("Cpus_string=%s is not a supported format for cpu_list."
-                      % cpus_string)
-    # Init a list for result.
-    affinity = []
-    for i in range(int(num_cpus)):
-        affinity.append('-')
+    num_cpus = int(num_cpus)
     # Letter 'r' means all cpus.
     if cpus_string == "r":
-        for i in range(len(affinity)):
-            affinity[i] = "y"
-        return affinity
+        return ["y"] * num_cpus
+    # Check the input string.
+    if not _is_valid_cpus_string(cpus_string):
+        raise exceptions.TestError("Cpus_string=%s is not a supported format "
+                                   "for cpu_list." % cpus_string)
+    # Init a buffer for result.
+    affinity = bytearray(b"-" * num_cpus)
     # Split the string with ','.
     sub_cpus = cpus_string.split(",")
     # Parse each sub_cpus.
     for cpus in sub_cpus:
         if "-" in cpus:
-            minmum = cpus.split("-")[0]
-            maxmum = cpus.split("-")[-1]
-            for i in range(int(minmum), int(maxmum) + 1):
-                affinity[i] = "y"
+            minmum, _, maxmum = cpus.partition("-")
+            minmum, maxmum = int(minmum), int(maxmum)
+            # Slice assignment would silently grow the buffer
+            if maxmum >= num_cpus:
+                raise IndexError("cpu %s out of range" % maxmum)
+            affinity[minmum:maxmum + 1] = b"y" * (maxmum - minmum + 1)
         elif "^" in cpus:
-            affinity[int(cpus.strip("^"))] = "-"
+            affinity[int(cpus.strip("^"))] = ord("-")
         else:
-            affinity[int(cpus)] = "y"
-    return affinity
+            affinity[int(cpus)] = ord("y")
+    return list(affinity.decode())
 
 
 def cpu_allowed_list_by_task(pid, tid):
     """
     Get the Cpus_allowed_list in status of task.
     """
-    cmd = "cat /proc/%s/task/%s/status|grep Cpus_allowed_list:| awk '{print $2}'" % (
-        pid, tid)
-    result = process.run(cmd, ignore_status=True, shell=True)
-    if result.exit_status:
+    status_path = "/proc/%s/task/%s/status" % (pid, tid)
+    try:
+        with open(status_path) as status_file:
+            for line in status_file:
+                if line.startswith("Cpus_allowed_list:"):
+                    return line.split(":", 1)[1].strip()
+    except IOError:
         return None
-    return result.stdout.strip()
+    return None
 
 
-def clean_up_snapshots(vm_name, snapshot_list=[], domxml=None):
+def _ensure_dir(path):
+    """
+    Create directory path, and its missing parents, unless it already
+    exists.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as detail:
+        if detail.errno != errno.EEXIST:
+            raise
+
+
+def _enable_sebool(name):
+    """
+    Turn the SELinux boolean name on, unless it is already on.
+
+    Use the libselinux bindings when available, setsebool otherwise.
+    """
+    if selinux is not None and selinux.is_selinux_enabled() == 1:
+        if selinux.security_get_boolean_active(name) != 1:
+            selinux.security_set_boolean(name, 1)
+            selinux.security_commit_booleans()
+        return
+    process.system("setsebool %s on" % name)
+
+
+def _remove_files(paths):
+    """
+    Remove the given files, ignoring the ones which do not exist.
+
+    :param paths: Iterable of file paths, empty entries are skipped
+    """
+    for path in filter(None, paths):
+        try:
+            os.unlink(path)
+        except OSError as detail:
+            if detail.errno != errno.ENOENT:
+                logging.warning("Failed to remove %s: %s", path, detail)
+
+
+def clean_up_snapshots(vm_name, snapshot_list=None, domxml=None):
     """
     Do recovery after snapshot
 
@@ -272,16 +358,17 @@ def clean_up_snapshots(vm_name, snapshot_list=[], domxml=None):
         snapshot_list = virsh.snapshot_list(vm_name)
 
         # Get snapshot disk path
+        snap_files = []
         for snap_name in snapshot_list:
-            # Delete useless disk snapshot file if exists
             snap_xml = virsh.snapshot_dumpxml(vm_name,
                                               snap_name).stdout.strip()
             xtf_xml = xml_utils.XMLTreeFile(snap_xml)
             disks_path = xtf_xml.findall('disks/disk/source')
-            for disk in disks_path:
-                os.system('rm -f %s' % disk.get('file'))
+            snap_files.extend(disk.get('file') for disk in disks_path)
             # Delete snapshots of vm
             virsh.snapshot_delete(vm_name, snap_name)
+        # Delete useless disk snapshot files if exist
+        _remove_files(snap_files)
 
         # External disk snapshot couldn't be deleted by virsh command,
         # It need to be deleted by qemu-img command
@@ -307,9 +394,8 @@ def clean_up_snapshots(vm_name, snapshot_list=[], domxml=None):
         # there is no snapshot info with the name
         dom_xml = vm_xml.VMXML.new_from_dumpxml(vm_name).xmltreefile
         disk_path = dom_xml.find('devices/disk/source').get('file')
-        for name in snapshot_list:
-            snap_disk_path = disk_path.split(".")[0] + "." + name
-            os.system('rm -f %s' % snap_disk_path)
+        disk_base = os.path.splitext(disk_path)[0]
+        _remove_files("%s.%s" % (disk_base, name) for name in snapshot_list)
 
 
 def get_all_cells():
@@ -334,20 +420,20 @@ def get_all_cells():
     """
     fc_result = virsh.freecell(options="--all", ignore_status=True)
     if fc_result.exit_status:
-        if fc_result.stderr.count("NUMA not supported"):
-            raise exceptions.TestSkipError(fc_result.stderr.strip())
+        err = fc_result.stderr.strip()
+        if "NUMA not supported" in err:
+            raise exceptions.TestSkipError(err)
         else:
-            raise exceptions.TestFail(fc_result.stderr.strip())
+            raise exceptions.TestFail(err)
     output = fc_result.stdout.strip()
-    cell_list = output.splitlines()
-    # remove "------------" line
-    del cell_list[-2]
     cell_dict = {}
-    for cell_line in cell_list:
-        cell_info = cell_line.split(":")
-        cell_num = cell_info[0].strip()
-        cell_mem = cell_info[-1].strip()
-        cell_dict[cell_num] = cell_mem
+    for cell_line in output.splitlines():
+        # skip "------------" line
+        if not cell_line or cell_line.lstrip().startswith("-"):
+            continue
+        cell_num, sep, cell_mem = cell_line.partition(":")
+        if sep:
+            cell_dict[cell_num.strip()] = cell_mem.strip()
     return cell_dict
 
 
@@ -383,10 +469,7 @@ def check_blockjob(vm_name, target, check_point="none", value="0"):
             return False
         return True
     if check_point == "progress":
-        progress = value + " %"
-        if re.search(progress, err):
-            return True
-        return False
+        return (value + " %") in err
     # Since 1.3.3-1, libvirt support bytes and scaled integers for bandwith,
     # and the output of blockjob may looks like:
     # # virsh blockjob avocado-vt-vm1 vda --info
@@ -396,7 +479,7 @@ def check_blockjob(vm_name, target, check_point="none", value="0"):
     # and universalize the unit before comparing
     if check_point == "bandwidth":
         try:
-            bandwidth, unit = re.findall(r'(\d+) (\w+)/s', output)[0]
+            bandwidth, unit = _RE_BANDWIDTH.findall(output)[0]
             # unit could be 'bytes' or 'Mib'
             if unit == 'bytes':
                 unit = 'B'
@@ -455,7 +538,7 @@ def setup_or_cleanup_nfs(is_setup, mount_dir="nfs-mount", is_mount=False,
              selinux_status_bak: SELinux status before set
     """
     result = {}
-    ubuntu = distro.detect().name == 'Ubuntu'
+    ubuntu = _IS_UBUNTU
 
     tmpdir = data_dir.get_tmp_dir()
     if not os.path.isabs(export_dir):
@@ -533,7 +616,7 @@ def setup_or_cleanup_iscsi(is_setup, is_login=True,
             # _iscsi.export_target() will have set the emulated_id and
             # export_flag already on success...
             _iscsi.cleanup()
-            process.run("rm -f %s" % emulated_path)
+            _remove_files([emulated_path])
         else:
             _iscsi.export_target()
             return (emulated_target, _iscsi.luns)
@@ -541,7 +624,7 @@ def setup_or_cleanup_iscsi(is_setup, is_login=True,
         _iscsi.export_flag = True
         _iscsi.emulated_id = _iscsi.get_target_id()
         _iscsi.cleanup()
-        process.run("rm -f %s" % emulated_path)
+        _remove_files([emulated_path])
     return ""
 
 
@@ -549,17 +632,15 @@ def get_host_ipv4_addr():
     """
     Get host ipv4 addr
     """
-    if_up = utils_net.get_net_if(state="UP")
-    for i in if_up:
-        ipv4_value = utils_net.get_net_if_addrs(i)["ipv4"]
-        logging.debug("ipv4_value is %s", ipv4_value)
-        if ipv4_value != []:
+    ip_addr = None
+    for i in utils_net.get_net_if(state="UP"):
+        ipv4_value = utils_net.get_net_if_addrs(i).get("ipv4")
+        if ipv4_value:
             ip_addr = ipv4_value[0]
             break
-    if ip_addr is not None:
-        logging.info("ipv4 address is %s", ip_addr)
-    else:
+    if ip_addr is None:
         raise exceptions.TestFail("Fail to get ip address")
+    logging.info("ipv4 address is %s", ip_addr)
     return ip_addr
 
 
@@ -587,7 +668,10 @@ def setup_or_cleanup_gluster(is_setup, vol_name, brick_path="", pool_name="",
         gluster.gluster_vol_create(vol_name, ip_addr, brick_path, force=True)
         gluster.gluster_allow_insecure(vol_name)
         gluster.gluster_nfs_disable(vol_name)
-        logging.debug("The contents of %s: \n%s", file_path, open(file_path).read())
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            with open(file_path) as vol_file:
+                logging.debug("The contents of %s: \n%s", file_path,
+                              vol_file.read())
         logging.debug("finish vol create in gluster")
         return ip_addr
     else:
@@ -620,8 +704,8 @@ def define_pool(pool_name, pool_type, pool_target, cleanup_flag, **kwargs):
     cleanup_logical = False
     selinux_bak = ""
     cleanup_gluster = False
-    if not os.path.exists(pool_target) and pool_type != "gluster":
-        os.mkdir(pool_target)
+    if pool_type != "gluster":
+        _ensure_dir(pool_target)
     if pool_type == "dir":
         pass
     elif pool_type == "netfs":
@@ -708,12 +792,11 @@ def verify_virsh_console(session, user, passwd, timeout=10, debug=False):
     """
     log = ""
     console_cmd = "cat /proc/cpuinfo"
+    match_list = _CONSOLE_PATTERNS + [session.prompt]
     try:
         while True:
             match, text = session.read_until_last_line_matches(
-                [r"[E|e]scape character is", r"login:",
-                 r"[P|p]assword:", session.prompt],
-                timeout, internal_timeout=1)
+                match_list, timeout, internal_timeout=1)
 
             if match == 0:
                 if debug:
@@ -742,7 +825,7 @@ def verify_virsh_console(session, user, passwd, timeout=10, debug=False):
         session.close()
         return False
 
-    if not re.search("processor", output):
+    if not _RE_PROCESSOR.search(output):
         logging.error("Verify virsh console failed: Result does not match.")
         return False
 
@@ -765,14 +848,11 @@ def pci_label_from_address(address_dict, radix=10):
         return = pci_0000_08_10_0
     """
     try:
-        domain = int(address_dict['domain'], radix)
-        bus = int(address_dict['bus'], radix)
-        slot = int(address_dict['slot'], radix)
-        function = int(address_dict['function'], radix)
+        pci_address = tuple(int(value, radix)
+                            for value in _PCI_ADDRESS_KEYS(address_dict))
     except (TypeError, KeyError) as detail:
         raise exceptions.TestError(detail)
-    pci_label = ("pci_%04x_%02x_%02x_%01x" % (domain, bus, slot, function))
-    return pci_label
+    return _PCI_LABEL_FMT % pci_address
 
 
 def mk_label(disk, label="msdos", session=None):
@@ -788,13 +868,14 @@ def mk_label(disk, label="msdos", session=None):
 
 def mk_part(disk, size="100M", fs_type='ext4', session=None):
     """
-    Create a partition for disk
+    Create partition(s) for disk
+
+    :param size: Size of the new partition, or a list of sizes to create
+                 several partitions with a single parted command
     """
     # TODO: This is just a temporary function to create partition for
     # testing usage, should be replaced by a more robust one.
-    support_lable = ['unknown', 'gpt', 'msdos']
     disk_label = 'msdos'
-    part_type = 'primary'
     part_start = '0'
 
     run_cmd = process.system_output
@@ -803,34 +884,55 @@ def mk_part(disk, size="100M", fs_type='ext4', session=None):
 
     print_cmd = "parted -s %s print" % disk
     output = run_cmd(print_cmd)
-    current_label = re.search(r'Partition Table: (\w+)', output).group(1)
-    if current_label not in support_lable:
+    current_label = None
+    disk_size = None
+    current_parts = []
+    disk_prefix = "Disk %s:" % disk
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith("Partition Table:"):
+            current_label = line.split(":", 1)[1].strip()
+        elif line.startswith(disk_prefix):
+            disk_size = line[len(disk_prefix):].split()[0]
+        else:
+            fields = line.split()
+            if len(fields) >= 4 and fields[0].isdigit():
+                current_parts.append({'num': fields[0], 'start': fields[1],
+                                      'end': fields[2], 'size': fields[3]})
+    if current_label not in _SUPPORTED_DISK_LABELS:
         logging.error('Not support create partition on %s disk', current_label)
         return
 
-    disk_size = re.search(r"Disk %s: (\w+)" % disk, output).group(1)
-    pat = r'(?P<num>\d+)\s+(?P<start>\S+)\s+(?P<end>\S+)\s+(?P<size>\S+)\s+'
-    current_parts = [m.groupdict() for m in re.finditer(pat, output)]
-
     mkpart_cmd = "parted -s -a optimal %s" % disk
     if current_label == 'unknown':
         mkpart_cmd += " mklabel %s" % disk_label
+        current_label = disk_label
     if len(current_parts) > 0:
         part_start = current_parts[-1]['end']
-    part_end = (float(utils_misc.normalize_data_size(part_start,
-                                                     factor='1000')) +
-                float(utils_misc.normalize_data_size(size, factor='1000')))
-
-    # Deal with msdos disk
-    if current_label == 'msdos':
-        if len(current_parts) == 3:
-            extended_cmd = " mkpart extended %s %s" % (part_start, disk_size)
-            run_cmd(mkpart_cmd + extended_cmd)
-        if len(current_parts) > 2:
-            part_type = 'logical'
-
-    mkpart_cmd += ' mkpart %s %s %s %s' % (part_type, fs_type, part_start,
-                                           part_end)
+    part_count = len(current_parts)
+    if not isinstance(size, list):
+        size = [size]
+
+    for part_size in size:
+        part_type = 'primary'
+        part_end = (float(utils_misc.normalize_data_size(part_start,
+                                                         factor='1000')) +
+                    float(utils_misc.normalize_data_size(part_size,
+                                                         factor='1000')))
+        # Deal with msdos disk
+        if current_label == 'msdos':
+            if part_count == 3:
+                mkpart_cmd += " mkpart extended %s %s" % (part_start,
+                                                          disk_size)
+                part_count += 1
+            if part_count > 2:
+                part_type = 'logical'
+
+        mkpart_cmd += ' mkpart %s %s %s %s' % (part_type, fs_type, part_start,
+                                               part_end)
+        part_count += 1
+        # parted takes unitless numbers as MB
+        part_start = "%sMB" % part_end
     run_cmd(mkpart_cmd)
 
 
@@ -838,13 +940,7 @@ def mkfs(partition, fs_type, options="", session=None):
     """
     Force to make a file system on the partition
     """
-    force_option = ''
-    if fs_type in ['ext2', 'ext3', 'ext4', 'ntfs']:
-        force_option = '-F'
-    elif fs_type in ['fat', 'vfat', 'msdos']:
-        force_option = '-I'
-    elif fs_type in ['xfs', 'btrfs']:
-        force_option = '-f'
+    force_option = _MKFS_FORCE_OPTIONS.get(fs_type, '')
     mkfs_cmd = "mkfs.%s %s %s %s" % (fs_type, force_option, partition, options)
     if session:
         session.cmd(mkfs_cmd)
@@ -861,15 +957,8 @@ def get_parts_list(session=None):
         _, parts_out = session.cmd_status_output(parts_cmd)
     else:
         parts_out = process.run(parts_cmd).stdout
-    parts = []
-    if parts_out:
-        for line in parts_out.rsplit("\n"):
-            if line.startswith("major") or line == "":
-                continue
-            parts_line = line.rsplit()
-            if len(parts_line) == 4:
-                parts.append(parts_line[3])
-    logging.debug("Find parts: %s" % parts)
+    parts = _RE_PARTS.findall(parts_out or "")
+    logging.debug("Find parts: %s", parts)
     return parts
 
 
@@ -879,16 +968,33 @@ def yum_install(pkg_list, session=None):
     """
     if not isinstance(pkg_list, list):
         raise exceptions.TestError("Parameter error.")
-    yum_cmd = "rpm -q {0} || yum -y install {0}"
-    for pkg in pkg_list:
+    if not pkg_list:
+        return
+
+    def run_cmd(cmd):
         if session:
-            status = session.cmd_status(yum_cmd.format(pkg))
-        else:
-            status = process.run(yum_cmd.format(pkg),
-                                 shell=True).exit_status
-        if status:
-            raise exceptions.TestFail("Failed to install package: %s"
-                                      % pkg)
+            return session.cmd_status_output(cmd)
+        result = process.run(cmd, ignore_status=True, shell=True)
+        return result.exit_status, result.stdout
+
+    def missing_pkgs(pkgs):
+        # rpm prints "package <name> is not installed" for each missing one
+        status, output = run_cmd("rpm -q %s" % " ".join(pkgs))
+        if not status:
+            return []
+        missing = [pkg for pkg in pkgs
+                   if "package %s is not installed" % pkg in output]
+        # rpm failed for another reason, assume nothing is installed
+        return missing or list(pkgs)
+
+    missing = missing_pkgs(pkg_list)
+    if not missing:
+        return
+    run_cmd("yum -y install %s" % " ".join(missing))
+    missing = missing_pkgs(missing)
+    if missing:
+        raise exceptions.TestFail("Failed to install package: %s"
+                                  % " ".join(missing))
 
 
 def check_actived_pool(pool_name):
@@ -896,14 +1002,40 @@ def check_actived_pool(pool_name):
     Check if pool_name exist in active pool list
     """
     sp = libvirt_storage.StoragePool()
-    if not sp.pool_exists(pool_name):
+    try:
+        pool_details = sp.list_pools().get(pool_name)
+    except process.CmdError:
+        pool_details = None
+    if pool_details is None:
         raise exceptions.TestFail("Can't find pool %s" % pool_name)
-    if not sp.is_pool_active(pool_name):
+    if pool_details.get('State') != "active":
         raise exceptions.TestFail("Pool %s is not active." % pool_name)
     logging.debug("Find active pool %s", pool_name)
     return True
 
 
+def _get_iscsi_scsi_host(device_name):
+    """
+    Get the scsi host number an iscsi attached disk belongs to.
+
+    :param device_name: Attached disk name, such as "sdb"
+    :return: The host number string, or "" if not found
+    """
+    output = process.system_output("iscsiadm -m session -P 3",
+                                   ignore_status=True)
+    scsi_host = ""
+    for line in output.splitlines():
+        fields = line.split()
+        # e.g. "Host Number: 7	State: running"
+        if fields[:2] == ["Host", "Number:"] and len(fields) > 2:
+            scsi_host = fields[2]
+        # e.g. "Attached scsi disk sdb		State: running"
+        elif (fields[:3] == ["Attached", "scsi", "disk"] and
+              fields[3:4] == [device_name]):
+            return scsi_host
+    return ""
+
+
 class PoolVolumeTest(object):
 
     """Test class for storage pool or volume"""
@@ -923,14 +1055,28 @@ class PoolVolumeTest(object):
         source_name = kwargs.get('source_name')
         device_name = kwargs.get('device_name', "/DEV/EXAMPLE")
         try:
-            if sp.pool_exists(pool_name):
+            # One pool-list serves both the existence and the state check
+            try:
+                pool_details = sp.list_pools().get(pool_name)
+            except process.CmdError:
+                pool_details = None
+            if pool_details is not None:
                 pv = libvirt_storage.PoolVolume(pool_name)
                 if pool_type in ["dir", "netfs", "logical", "disk"]:
-                    if sp.is_pool_active(pool_name):
-                        vols = pv.list_volumes()
-                        for vol in vols:
-                            # Ignore failed deletion here for deleting pool
-                            pv.delete_volume(vol)
+                    if pool_details.get('State') == "active":
+                        vols = list(pv.list_volumes())
+                        # Ignore failed deletion here for deleting pool
+                        if pool_type in ["dir", "netfs"] and len(vols) > 1:
+                            # File based volumes are independent, but disk
+                            # and logical ones share the partition table/VG
+                            step = _MAX_PARALLEL_VOL_DELETE
+                            for i in range(0, len(vols), step):
+                                utils_misc.parallel(
+                                    [(pv.delete_volume, (vol,))
+                                     for vol in vols[i:i + step]])
+                        else:
+                            for vol in vols:
+                                pv.delete_volume(vol)
                 if not sp.delete_pool(pool_name):
                     raise exceptions.TestFail(
                         "Delete pool %s failed" % pool_name)
@@ -940,11 +1086,12 @@ class PoolVolumeTest(object):
                 nfs_path = os.path.join(self.tmpdir, nfs_server_dir)
                 setup_or_cleanup_nfs(is_setup=False, export_dir=nfs_path,
                                      restore_selinux=self.selinux_bak)
-                if os.path.exists(nfs_path):
-                    shutil.rmtree(nfs_path)
+                shutil.rmtree(nfs_path, ignore_errors=True)
             if pool_type == "logical":
-                cmd = "pvs |grep vg_logical|awk '{print $1}'"
-                pv = process.system_output(cmd, shell=True)
+                pvs_out = process.system_output(
+                    "pvs --noheadings -o pv_name,vg_name", ignore_status=True)
+                pv = " ".join(line.split()[0] for line in pvs_out.splitlines()
+                              if line.split()[1:] == ["vg_logical"])
                 # Cleanup logical volume anyway
                 process.run("vgremove -f vg_logical", ignore_status=True)
                 process.run("pvremove %s" % pv, ignore_status=True)
@@ -964,8 +1111,7 @@ class PoolVolumeTest(object):
                         os.remove(scsi_xml_file)
             if pool_type in ["dir", "fs", "netfs"]:
                 pool_target = os.path.join(self.tmpdir, pool_target)
-                if os.path.exists(pool_target):
-                    shutil.rmtree(pool_target)
+                shutil.rmtree(pool_target, ignore_errors=True)
             if pool_type == "gluster" or source_format == 'glusterfs':
                 setup_or_cleanup_gluster(False, source_name,
                                          pool_name=pool_name)
@@ -1002,8 +1148,7 @@ class PoolVolumeTest(object):
         if pool_type == "dir":
             if not os.path.isdir(pool_target):
                 pool_target = os.path.join(self.tmpdir, pool_target)
-            if not os.path.exists(pool_target):
-                os.mkdir(pool_target)
+            _ensure_dir(pool_target)
         elif pool_type == "disk":
             extra = " --source-dev %s" % device_name
             # msdos is libvirt default pool source format, but libvirt use
@@ -1022,12 +1167,10 @@ class PoolVolumeTest(object):
             # If pre_disk_vol is None, disk pool will have no volume
             pre_disk_vol = kwargs.get('pre_disk_vol', None)
             if type(pre_disk_vol) == list and len(pre_disk_vol):
-                for vol in pre_disk_vol:
-                    mk_part(device_name, vol)
+                mk_part(device_name, pre_disk_vol)
         elif pool_type == "fs":
             pool_target = os.path.join(self.tmpdir, pool_target)
-            if not os.path.exists(pool_target):
-                os.mkdir(pool_target)
+            _ensure_dir(pool_target)
             if not source_format:
                 source_format = 'ext4'
             mkfs(device_name, source_format)
@@ -1045,8 +1188,7 @@ class PoolVolumeTest(object):
             export_options = kwargs.get('export_options',
                                         "rw,async,no_root_squash")
             pool_target = os.path.join(self.tmpdir, pool_target)
-            if not os.path.exists(pool_target):
-                os.mkdir(pool_target)
+            _ensure_dir(pool_target)
             if source_format == 'glusterfs':
                 hostip = setup_or_cleanup_gluster(True, source_name,
                                                   pool_name=pool_name)
@@ -1054,13 +1196,12 @@ class PoolVolumeTest(object):
                 extra = "--source-host %s --source-path %s" % (hostip,
                                                                source_name)
                 extra += " --source-format %s" % source_format
-                process.system("setsebool virt_use_fusefs on")
+                _enable_sebool("virt_use_fusefs")
             else:
                 nfs_server_dir = self.params.get(
                     "nfs_server_dir", "nfs-server")
                 nfs_path = os.path.join(self.tmpdir, nfs_server_dir)
-                if not os.path.exists(nfs_path):
-                    os.mkdir(nfs_path)
+                _ensure_dir(nfs_path)
                 res = setup_or_cleanup_nfs(is_setup=True,
                                            export_options=export_options,
                                            export_dir=nfs_path)
@@ -1106,9 +1247,8 @@ class PoolVolumeTest(object):
                     is_setup=True,
                     emulated_image=emulated_image,
                     image_size=image_size)
-                cmd = ("iscsiadm -m session -P 3 |grep -B3 %s| grep Host|awk "
-                       "'{print $3}'" % logical_device.split('/')[2])
-                scsi_host = process.system_output(cmd, shell=True).strip()
+                scsi_host = _get_iscsi_scsi_host(
+                    logical_device.split('/')[2])
                 scsi_pool_xml = pool_xml.PoolXML()
                 scsi_pool_xml.name = pool_name
                 scsi_pool_xml.pool_type = "scsi"
@@ -1170,8 +1310,10 @@ class PoolVolumeTest(object):
             self.cleanup_pool(pool_name, pool_type, pool_target,
                               emulated_image, **kwargs)
             raise exceptions.TestFail("Prepare pool failed")
-        xml_str = virsh.pool_dumpxml(pool_name)
-        logging.debug("New prepared pool XML: %s", xml_str)
+        # Dumping the XML is only for the debug log
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            xml_str = virsh.pool_dumpxml(pool_name)
+            logging.debug("New prepared pool XML: %s", xml_str)
 
     def pre_vol(self, vol_name, vol_format, capacity, allocation, pool_name):
         """
@@ -1204,7 +1346,7 @@ class MigrationTest(object):
         # Result of virsh migrate command
         # True means command executed successfully
         self.RET_MIGRATION = True
-        # A lock for threads
+        # Not used here any more, kept for tests that still take it
         self.RET_LOCK = threading.RLock()
         # The time spent when migrating vms
         # format: vm_name -> time(seconds)
@@ -1297,9 +1439,7 @@ class MigrationTest(object):
             is_error = True
         finally:
             if is_error is True:
-                self.RET_LOCK.acquire()
                 self.RET_MIGRATION = False
-                self.RET_LOCK.release()
 
     def migrate_pre_setup(self, desturi, params,
                           cleanup=False,
@@ -1323,14 +1463,16 @@ class MigrationTest(object):
             if ((desturi == "qemu:///system") or (dest_ip == source_ip)):
                 # open migration ports in local machine using iptables
                 Iptables.setup_or_cleanup_iptables_rules(iptable_rule,
-                                                         cleanup=cleanup)
+                                                         cleanup=cleanup,
+                                                         atomic=True)
                 # SMT for Power8 machine is turned off for local machine during
                 # test setup
             else:
                 # open migration ports in remote machine using iptables
                 Iptables.setup_or_cleanup_iptables_rules(iptable_rule,
                                                          params=params,
-                                                         cleanup=cleanup)
+                                                         cleanup=cleanup,
+                                                         atomic=True)
                 cmd = "grep cpu /proc/cpuinfo | awk '{print $3}' | head -n 1"
                 server_ip = params.get("server_ip")
                 server_user = params.get("server_user", "root")
@@ -1406,11 +1548,9 @@ class MigrationTest(object):
                 logging.debug("start_time:%d, eclipse_time:%d", stime, eclipse_time)
                 if eclipse_time < thread_timeout:
                     migration_thread.join(thread_timeout - eclipse_time)
-                if migration_thread.isAlive():
+                if migration_thread.is_alive():
                     logging.error("Migrate %s timeout.", migration_thread)
-                    self.RET_LOCK.acquire()
                     self.RET_MIGRATION = False
-                    self.RET_LOCK.release()
         elif migration_type == "cross":
             # Migrate a vm to remote first,
             # then migrate another to remote with the first vm back
@@ -1423,14 +1563,14 @@ class MigrationTest(object):
                                            args=(vm, desturi, options))
                 thread1.start()
                 thread2.start()
+                # Both migrations share one timeout window
+                deadline = time.time() + thread_timeout
                 thread1.join(thread_timeout)
-                thread2.join(thread_timeout)
+                thread2.join(max(deadline - time.time(), 0))
                 vm_remote = vm
-                if thread1.isAlive() or thread1.isAlive():
+                if thread1.is_alive() or thread2.is_alive():
                     logging.error("Cross migrate timeout.")
-                    self.RET_LOCK.acquire()
                     self.RET_MIGRATION = False
-                    self.RET_LOCK.release()
             # Add popped vm back to list
             vms.append(vm_remote)
         elif migration_type == "simultaneous":
@@ -1444,13 +1584,16 @@ class MigrationTest(object):
                 thread.start()
 
             # listen threads until they end
+            timeout_threads = []
             for thread in migration_threads:
                 thread.join(thread_timeout)
-                if thread.isAlive():
+                if thread.is_alive():
+                    timeout_threads.append(thread)
+            # Record the timeouts once all threads have been joined
+            if timeout_threads:
+                for thread in timeout_threads:
                     logging.error("Migrate %s timeout.", thread)
-                    self.RET_LOCK.acquire()
-                    self.RET_MIGRATION = False
-                    self.RET_LOCK.release()
+                self.RET_MIGRATION = False
 
         if not self.RET_MIGRATION and not ignore_status:
             raise exceptions.TestFail()
@@ -1480,10 +1623,11 @@ class MigrationTest(object):
 
         :return: True if state of VM is as expected, False otherwise
         """
-        if not virsh.domain_exists(vm.name, uri=uri):
+        # domstate fails when the domain does not exist (yet)
+        result = virsh.domstate(vm.name, uri=uri, ignore_status=True)
+        if result.exit_status:
             return False
-        vm_state = virsh.domstate(vm.name, uri=uri).stdout.strip()
-        return vm_state.lower() == state.lower()
+        return result.stdout.strip().lower() == state.lower()
 
     def wait_for_migration_start(self, vm, state='paused', uri=None, timeout=60):
         """
@@ -1504,6 +1648,20 @@ class MigrationTest(object):
         return utils_misc.wait_for(check_state, timeout)
 
 
+def _first_match(patterns, text):
+    """
+    Find the first regex pattern matching text.
+
+    :param patterns: list of regex patterns
+    :param text: string to search
+    :return: the matching pattern, or None
+    """
+    for patt in patterns:
+        if re.search(patt, text):
+            return patt
+    return None
+
+
 def check_result(result, expected_fails=[], skip_if=[], any_error=False):
     """
     Check the result of a command and check command error message against
@@ -1517,13 +1675,12 @@ def check_result(result, expected_fails=[], skip_if=[], any_error=False):
     :param any_error: Whether expect on any error message. Setting to True will
                       will override expected_fails
     """
-    logging.debug("Command result:\n%s" % result)
-    if skip_if:
-        for patt in skip_if:
-            if re.search(patt, result.stderr):
-                raise exceptions.TestSkipError("Test skipped: found '%s' in test "
-                                               "result:\n%s" %
-                                               (patt, result.stderr))
+    logging.debug("Command result:\n%s", result)
+    skip_patt = _first_match(skip_if, result.stderr)
+    if skip_patt is not None:
+        raise exceptions.TestSkipError("Test skipped: found '%s' in test "
+                                       "result:\n%s" %
+                                       (skip_patt, result.stderr))
     if any_error:
         if result.exit_status:
             return
@@ -1533,8 +1690,7 @@ def check_result(result, expected_fails=[], skip_if=[], any_error=False):
 
     if result.exit_status:
         if expected_fails:
-            if not any(re.search(patt, result.stderr)
-                       for patt in expected_fails):
+            if _first_match(expected_fails, result.stderr) is None:
                 raise exceptions.TestFail("Expect should fail with one of %s, "
                                           "but failed with:\n%s" %
                                           (expected_fails, result))
@@ -1573,24 +1729,15 @@ def get_interface_details(vm_name):
     """
     # Parse the domif-list command output
     domiflist_out = virsh.domiflist(vm_name).stdout
-    # Regular expression for the below output
+    # Rows are like
     #   vnet0    bridge    virbr0   virtio  52:54:00:b2:b3:b4
-    rg = re.compile(r"^(\w+|-)\s+(\w+)\s+(\w+)\s+(\S+)\s+"
-                    "(([a-fA-F0-9]{2}:?){6})")
-
-    iface_cmd = {}
+    keys = ('interface', 'type', 'source', 'model', 'mac')
     ifaces_cmd = []
-    for line in domiflist_out.split('\n'):
-        match_obj = rg.search(line)
-        # Due to the extra space in the list
-        if match_obj is not None:
-            iface_cmd['interface'] = match_obj.group(1)
-            iface_cmd['type'] = match_obj.group(2)
-            iface_cmd['source'] = match_obj.group(3)
-            iface_cmd['model'] = match_obj.group(4)
-            iface_cmd['mac'] = match_obj.group(5)
-            ifaces_cmd.append(iface_cmd)
-            iface_cmd = {}
+    for line in domiflist_out.splitlines():
+        fields = line.split()
+        # The MAC check skips the header and the separator line
+        if len(fields) == 5 and _RE_MAC.match(fields[4]):
+            ifaces_cmd.append(dict(zip(keys, fields)))
     return ifaces_cmd
 
 
@@ -1600,11 +1747,28 @@ def get_ifname_host(vm_name, mac):
 
     :return: interface name, None if not exist
     """
-    ifaces = get_interface_details(vm_name)
-    for iface in ifaces:
-        if iface["mac"] == mac:
-            return iface["interface"]
-    return None
+    domiflist_out = virsh.domiflist(vm_name).stdout
+    # Same row layout as parsed by get_interface_details, MAC column fixed
+    match_obj = re.search(r"^[ \t]*(\S+)[ \t]+\S+[ \t]+\S+[ \t]+\S+[ \t]+%s"
+                          r"(?![a-fA-F0-9:])" % re.escape(mac),
+                          domiflist_out, re.MULTILINE)
+    if match_obj is None:
+        return None
+    return match_obj.group(1)
+
+
+def _get_iface_list(extra=""):
+    """
+    Get the host interfaces listed by virsh iface-list.
+
+    :param extra: iface-list option
+    :return: dict of interface name -> (state, MAC address)
+    """
+    result = virsh.iface_list(extra, ignore_status=True)
+    check_exit_status(result, False)
+    # Skip the "Name State MAC Address" header
+    output = _RE_IFACE_LIST.findall(str(result.stdout))[1:]
+    return dict((iface[0], iface[1:]) for iface in output)
 
 
 def check_iface(iface_name, checkpoint, extra="", **dargs):
@@ -1625,14 +1789,8 @@ def check_iface(iface_name, checkpoint, extra="", **dargs):
     try:
         if checkpoint == "exists":
             # extra is iface-list option
-            list_find, ifcfg_find = (False, False)
             # Check virsh list output
-            result = virsh.iface_list(extra, ignore_status=True)
-            check_exit_status(result, False)
-            output = re.findall(r"(\S+)\ +(\S+)\ +(\S+|\s+)[\ +\n]",
-                                str(result.stdout))
-            if list(filter(lambda x: x[0] == iface_name, output[1:])):
-                list_find = True
+            list_find = iface_name in _get_iface_list(extra)
             logging.debug("Find '%s' in virsh iface-list output: %s",
                           iface_name, list_find)
             # Check network script independent of distro
@@ -1652,12 +1810,7 @@ def check_iface(iface_name, checkpoint, extra="", **dargs):
             logging.debug("IP address of %s: %s", iface_name, iface_ip)
         elif checkpoint == "state":
             # check iface State
-            result = virsh.iface_list(extra, ignore_status=True)
-            check_exit_status(result, False)
-            output = re.findall(r"(\S+)\ +(\S+)\ +(\S+|\s+)[\ +\n]",
-                                str(result.stdout))
-            iface_state = filter(lambda x: x[0] == iface_name, output[1:])
-            iface_state = list(iface_state)[0][1]
+            iface_state = _get_iface_list(extra)[iface_name][0]
             # active corresponds True, otherwise return False
             check_pass = iface_state == "active"
         elif checkpoint == "ping":
@@ -1675,6 +1828,21 @@ def check_iface(iface_name, checkpoint, extra="", **dargs):
     return check_pass
 
 
+def _parse_pci_id(pci_id):
+    """
+    Get the hostdev source address attributes of a PCI id.
+
+    :param pci_id: such as "0000:03:04.0"
+    :return: dict of domain, bus, slot and function, as hex strings
+    """
+    match_obj = _RE_PCI_ID.match(pci_id)
+    if match_obj is None:
+        raise exceptions.TestError("Invalid PCI Info: %s" % pci_id)
+    keys = ('domain', 'bus', 'slot', 'function')
+    return dict((key, "0x%s" % value)
+                for key, value in zip(keys, match_obj.groups()))
+
+
 def create_hostdev_xml(pci_id, boot_order=0):
     """
     Create a hostdev configuration file.
@@ -1682,14 +1850,7 @@ def create_hostdev_xml(pci_id, boot_order=0):
     :param pci_id: such as "0000:03:04.0"
     """
     # Create attributes dict for device's address element
-    device_domain = pci_id.split(':')[0]
-    device_domain = "0x%s" % device_domain
-    device_bus = pci_id.split(':')[1]
-    device_bus = "0x%s" % device_bus
-    device_slot = pci_id.split(':')[-1].split('.')[0]
-    device_slot = "0x%s" % device_slot
-    device_function = pci_id.split('.')[-1]
-    device_function = "0x%s" % device_function
+    attrs = _parse_pci_id(pci_id)
 
     hostdev_xml = hostdev.Hostdev()
     hostdev_xml.mode = "subsystem"
@@ -1697,8 +1858,6 @@ def create_hostdev_xml(pci_id, boot_order=0):
     hostdev_xml.hostdev_type = "pci"
     if boot_order:
         hostdev_xml.boot_order = boot_order
-    attrs = {'domain': device_domain, 'slot': device_slot,
-             'bus': device_bus, 'function': device_function}
     hostdev_xml.source_address = hostdev_xml.new_source_address(**attrs)
     logging.debug("Hostdev XML:\n%s", str(hostdev_xml))
     return hostdev_xml.xml
@@ -1719,19 +1878,7 @@ def alter_boot_order(vm_name, pci_id, boot_order=0):
     # remove all of OS boots
     vmxml.remove_all_boots()
     # prepare PCI-device XML with boot order
-    try:
-        device_domain = pci_id.split(':')[0]
-        device_domain = "0x%s" % device_domain
-        device_bus = pci_id.split(':')[1]
-        device_bus = "0x%s" % device_bus
-        device_slot = pci_id.split(':')[-1].split('.')[0]
-        device_slot = "0x%s" % device_slot
-        device_function = pci_id.split('.')[-1]
-        device_function = "0x%s" % device_function
-    except IndexError:
-        raise exceptions.TestError("Invalid PCI Info: %s" % pci_id)
-    attrs = {'domain': device_domain, 'slot': device_slot,
-             'bus': device_bus, 'function': device_function}
+    attrs = _parse_pci_id(pci_id)
     vmxml.add_hostdev(attrs, boot_order=boot_order)
     # synchronize XML
     vmxml.sync()
@@ -1794,8 +1941,8 @@ def create_disk_xml(params):
 
         sec_model = params.get("sec_model")
         relabel = params.get("relabel")
-        label = params.get("sec_label")
         if sec_model or relabel:
+            label = params.get("sec_label")
             sec_dict = {}
             sec_xml = seclabel.Seclabel()
             if sec_model:
@@ -1854,15 +2001,7 @@ def create_disk_xml(params):
         diskxml.xmltreefile.write()
     except Exception as detail:
         logging.error("Fail to create disk XML:\n%s", detail)
-    logging.debug("Disk XML %s:\n%s", diskxml.xml, str(diskxml))
-
-    # Wait for file completed
-    def file_exists():
-        if not process.run("ls %s" % diskxml.xml,
-                           ignore_status=True).exit_status:
-            return True
-    utils_misc.wait_for(file_exists, 5)
-
+    logging.debug("Disk XML %s:\n%s", diskxml.xml, diskxml)
     return diskxml.xml
 
 
@@ -1896,6 +2035,21 @@ def set_disk_attr(vmxml, target, tag, attr):
     return True
 
 
+def _parse_literal(value):
+    """
+    Evaluate a literal dict/list param, using the json parser when it can.
+
+    Values quoted the python way, such as "{'name': 'br0'}", are not
+    valid json and go straight to ast.literal_eval.
+    """
+    if "'" not in value:
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return ast.literal_eval(value)
+
+
 def create_net_xml(net_name, params):
     """
     Create a new network or update an existed network xml
@@ -1918,20 +2072,9 @@ def create_net_xml(net_name, params):
     net_bandwidth_outbound = params.get("net_bandwidth_outbound", "{}")
     net_ip_family = params.get("net_ip_family")
     net_ip_address = params.get("net_ip_address")
-    net_ip_netmask = params.get("net_ip_netmask", "255.255.255.0")
-    net_ipv6_address = params.get("net_ipv6_address")
-    net_ipv6_prefix = params.get("net_ipv6_prefix", "64")
     nat_port = params.get("nat_port")
     guest_name = params.get("guest_name")
-    guest_ipv4 = params.get("guest_ipv4")
-    guest_ipv6 = params.get("guest_ipv6")
     guest_mac = params.get("guest_mac")
-    dhcp_start_ipv4 = params.get("dhcp_start_ipv4", "192.168.122.2")
-    dhcp_end_ipv4 = params.get("dhcp_end_ipv4", "192.168.122.254")
-    dhcp_start_ipv6 = params.get("dhcp_start_ipv6")
-    dhcp_end_ipv6 = params.get("dhcp_end_ipv6")
-    tftp_root = params.get("tftp_root")
-    bootp_file = params.get("bootp_file")
     routes = params.get("routes", "").split()
     pg_name = params.get("portgroup_name", "").split()
     try:
@@ -1944,11 +2087,11 @@ def create_net_xml(net_name, params):
         if net_dns_forward:
             dns_dict["dns_forward"] = net_dns_forward
         if net_dns_txt:
-            dns_dict["txt"] = ast.literal_eval(net_dns_txt)
+            dns_dict["txt"] = _parse_literal(net_dns_txt)
         if net_dns_srv:
-            dns_dict["srv"] = ast.literal_eval(net_dns_srv)
+            dns_dict["srv"] = _parse_literal(net_dns_srv)
         if net_dns_forwarders:
-            dns_dict["forwarders"] = [ast.literal_eval(x) for x in
+            dns_dict["forwarders"] = [_parse_literal(x) for x in
                                       net_dns_forwarders]
         if net_dns_hostip:
             host_dict["host_ip"] = net_dns_hostip
@@ -1960,10 +2103,10 @@ def create_net_xml(net_name, params):
             host = dns_obj.new_host(**host_dict)
             dns_obj.host = host
         netxml.dns = dns_obj
-        bridge = ast.literal_eval(net_bridge)
+        bridge = _parse_literal(net_bridge)
         if bridge:
             netxml.bridge = bridge
-        forward = ast.literal_eval(net_forward)
+        forward = _parse_literal(net_forward)
         if forward:
             netxml.forward = forward
         if forward_iface:
@@ -1971,11 +2114,11 @@ def create_net_xml(net_name, params):
                 {'dev': x} for x in forward_iface.split()]
             netxml.forward_interface = interface
         if nat_port:
-            netxml.nat_port = ast.literal_eval(nat_port)
+            netxml.nat_port = _parse_literal(nat_port)
         if net_domain:
             netxml.domain_name = net_domain
-        net_inbound = ast.literal_eval(net_bandwidth_inbound)
-        net_outbound = ast.literal_eval(net_bandwidth_outbound)
+        net_inbound = _parse_literal(net_bandwidth_inbound)
+        net_outbound = _parse_literal(net_bandwidth_outbound)
         if net_inbound:
             netxml.bandwidth_inbound = net_inbound
         if net_outbound:
@@ -1984,6 +2127,11 @@ def create_net_xml(net_name, params):
             netxml.virtualport_type = net_virtualport
 
         if net_ip_family == "ipv6":
+            net_ipv6_address = params.get("net_ipv6_address")
+            net_ipv6_prefix = params.get("net_ipv6_prefix", "64")
+            dhcp_start_ipv6 = params.get("dhcp_start_ipv6")
+            dhcp_end_ipv6 = params.get("dhcp_end_ipv6")
+            guest_ipv6 = params.get("guest_ipv6")
             ipxml = network_xml.IPXML()
             ipxml.family = net_ip_family
             ipxml.prefix = net_ipv6_prefix
@@ -1998,6 +2146,12 @@ def create_net_xml(net_name, params):
                                 "ip": guest_ipv6}]
             netxml.set_ip(ipxml)
         if net_ip_address:
+            net_ip_netmask = params.get("net_ip_netmask", "255.255.255.0")
+            dhcp_start_ipv4 = params.get("dhcp_start_ipv4", "192.168.122.2")
+            dhcp_end_ipv4 = params.get("dhcp_end_ipv4", "192.168.122.254")
+            tftp_root = params.get("tftp_root")
+            bootp_file = params.get("bootp_file")
+            guest_ipv4 = params.get("guest_ipv4")
             ipxml = network_xml.IPXML(net_ip_address,
                                       net_ip_netmask)
             if dhcp_start_ipv4 and dhcp_end_ipv4:
@@ -2013,7 +2167,7 @@ def create_net_xml(net_name, params):
                                 "ip": guest_ipv4}]
             netxml.set_ip(ipxml)
         if routes:
-            netxml.routes = [ast.literal_eval(x) for x in routes]
+            netxml.routes = [_parse_literal(x) for x in routes]
         if pg_name:
             pg_default = params.get("portgroup_default",
                                     "").split()
@@ -2032,13 +2186,13 @@ def create_net_xml(net_name, params):
                 if len(pg_virtualport) > i:
                     pgxml.virtualport_type = pg_virtualport[i]
                 if len(pg_bandwidth_inbound) > i:
-                    pgxml.bandwidth_inbound = ast.literal_eval(
+                    pgxml.bandwidth_inbound = _parse_literal(
                         pg_bandwidth_inbound[i])
                 if len(pg_bandwidth_outbound) > i:
-                    pgxml.bandwidth_outbound = ast.literal_eval(
+                    pgxml.bandwidth_outbound = _parse_literal(
                         pg_bandwidth_outbound[i])
                 if len(pg_vlan) > i:
-                    pgxml.vlan_tag = ast.literal_eval(pg_vlan[i])
+                    pgxml.vlan_tag = _parse_literal(pg_vlan[i])
                 netxml.set_portgroup(pgxml)
         logging.debug("New network xml file: %s", netxml)
         netxml.xmltreefile.write()
@@ -2060,11 +2214,8 @@ def create_nwfilter_xml(params):
 
     # process filterref_name
     filterrefs_list = []
-    filterrefs_key = []
-    for i in list(params.keys()):
-        if 'filterref_name_' in i:
-            filterrefs_key.append(i)
-    filterrefs_key.sort()
+    filterrefs_key = sorted(key for key in params
+                            if key.startswith('filterref_name_'))
     for i in filterrefs_key:
         filterrefs_dict = {}
         filterrefs_dict['filter'] = params[i]
@@ -2073,7 +2224,6 @@ def create_nwfilter_xml(params):
     # prepare rule and protocol attributes
     protocol = {}
     rule_dict = {}
-    rule_dict_tmp = {}
     RULE_ATTR = ('rule_action', 'rule_direction', 'rule_priority',
                  'rule_statematch')
     PROTOCOL_TYPES = ['mac', 'vlan', 'stp', 'arp', 'rarp', 'ip', 'ipv6',
@@ -2084,18 +2234,12 @@ def create_nwfilter_xml(params):
     # rule should end with 'EOL' as separator, multiple rules are supported
     rule = params.get("rule")
     if rule:
-        rule_list = rule.split('EOL')
-        for i in range(len(rule_list)):
-            if rule_list[i]:
-                attr = rule_list[i].split()
-                for j in range(len(attr)):
-                    attr_list = attr[j].split('=')
-                    rule_dict_tmp[attr_list[0]] = attr_list[1]
-                rule_dict[i] = rule_dict_tmp
-                rule_dict_tmp = {}
+        for i, rule_attrs in enumerate(rule.split('EOL')):
+            if rule_attrs:
+                rule_dict[i] = dict(_RE_RULE_ATTR.findall(rule_attrs))
 
         # process protocol parameter
-        for i in list(rule_dict.keys()):
+        for i in rule_dict:
             if 'protocol' not in rule_dict[i]:
                 # Set protocol as string 'None' as parse from cfg is
                 # string 'None'
@@ -2133,13 +2277,13 @@ def create_nwfilter_xml(params):
         rulexml = rule.backup_rule()
         for i in index_total:
             filterxml.del_rule()
-        for i in range(len(list(rule_dict.keys()))):
+        for i in range(len(rule_dict)):
             rulexml.rule_action = rule_dict[i].get('rule_action')
             rulexml.rule_direction = rule_dict[i].get('rule_direction')
             rulexml.rule_priority = rule_dict[i].get('rule_priority')
             rulexml.rule_statematch = rule_dict[i].get('rule_statematch')
             for j in RULE_ATTR:
-                if j in list(rule_dict[i].keys()):
+                if j in rule_dict[i]:
                     rule_dict[i].pop(j)
 
             # set protocol attribute
@@ -2157,7 +2301,7 @@ def create_nwfilter_xml(params):
             rulexml = rule.backup_rule()
 
         filterxml.xmltreefile.write()
-        logging.info("The network filter xml is:\n%s" % filterxml)
+        logging.info("The network filter xml is:\n%s", filterxml)
         return filterxml
 
     except Exception as detail:
@@ -2265,21 +2409,20 @@ def set_guest_agent(vm):
     vmxml.sync()
     vm.start()
     session = vm.wait_for_login()
-    # Check if qemu-ga already started automatically
-    cmd = "rpm -q qemu-guest-agent || yum install -y qemu-guest-agent"
-    stat_install = session.cmd_status(cmd, 300)
-    if stat_install != 0:
+    # Install qemu-guest-agent and start it unless it already runs, in one
+    # round-trip, the last output line tells how far the guest got
+    cmd = ("if rpm -q qemu-guest-agent || yum install -y qemu-guest-agent; "
+           "then pgrep -x qemu-ga || qemu-ga -d; "
+           "pgrep -x qemu-ga >/dev/null && echo GA_RUNNING "
+           "|| echo GA_NOT_RUNNING; "
+           "else echo GA_NOT_INSTALLED; fi")
+    output = session.cmd_output(cmd, timeout=300).strip()
+    ga_status = output.splitlines()[-1] if output else ""
+    if ga_status == "GA_NOT_INSTALLED":
         raise exceptions.TestFail("Fail to install qemu-guest-agent, make "
                                   "sure that you have usable repo in guest")
-
-    # Check if qemu-ga already started
-    stat_ps = session.cmd_status("ps aux |grep [q]emu-ga")
-    if stat_ps != 0:
-        session.cmd("qemu-ga -d")
-        # Check if the qemu-ga really started
-        stat_ps = session.cmd_status("ps aux |grep [q]emu-ga")
-        if stat_ps != 0:
-            raise exceptions.TestFail("Fail to run qemu-ga in guest")
+    if ga_status != "GA_RUNNING":
+        raise exceptions.TestFail("Fail to run qemu-ga in guest")
 
 
 def set_vm_disk(vm, params, tmp_dir=None, test=None):
@@ -2344,10 +2487,25 @@ def set_vm_disk(vm, params, tmp_dir=None, test=None):
     mnt_path_name = params.get("mnt_path_name", "nfs-mount")
     exp_opt = params.get("export_options", "rw,no_root_squash,fsid=0")
     exp_dir = params.get("export_dir", "nfs-export")
-    first_disk = vm.get_first_disk_devices()
-    blk_source = first_disk['source']
-    disk_xml = vmxml.devices.by_device_tag('disk')[0]
-    src_disk_format = disk_xml.xmltreefile.find('driver').get('type')
+    # Take the first disk from the xml already dumped, not from domblklist,
+    # and only build device objects for the disk elements. Disks without a
+    # source, such as an empty cdrom, are skipped
+    blk_source = None
+    for disk_xml in vmxml.get_devices(device_type="disk"):
+        disk_source = disk_xml.xmltreefile.find('source')
+        if disk_source is None:
+            continue
+        blk_source = (disk_source.get('file') or disk_source.get('dev') or
+                      disk_source.get('name') or disk_source.get('volume'))
+        if blk_source:
+            break
+    if not blk_source:
+        raise exceptions.TestError("No disk with a source in %s" % vm.name)
+    # libvirt uses raw for a disk without driver type
+    disk_driver = disk_xml.xmltreefile.find('driver')
+    src_disk_format = "raw"
+    if disk_driver is not None:
+        src_disk_format = disk_driver.get('type', src_disk_format)
     sec_model = params.get('sec_model')
     relabel = params.get('relabel')
     sec_label = params.get('sec_label')
@@ -2403,7 +2561,7 @@ def set_vm_disk(vm, params, tmp_dir=None, test=None):
                          image_size=image_size)
             # Get volume name
             vols = get_vol_list(pool_name)
-            vol_name = list(vols.keys())[0]
+            vol_name = next(iter(vols))
             emulated_path = vols[vol_name]
         else:
             # Setup iscsi target
@@ -2439,21 +2597,20 @@ def set_vm_disk(vm, params, tmp_dir=None, test=None):
         # Setup gluster.
         host_ip = setup_or_cleanup_gluster(True, vol_name,
                                            brick_path, pool_name)
-        logging.debug("host ip: %s " % host_ip)
+        logging.debug("host ip: %s ", host_ip)
         dist_img = "gluster.%s" % disk_format
+        # qemu-img talks to the volume directly, no need to mount it
+        dist_path = "gluster://%s/%s/%s" % (host_ip, vol_name, dist_img)
 
         if image_convert:
             # Convert first disk to gluster disk path
-            disk_cmd = ("qemu-img convert -f %s -O %s %s /mnt/%s" %
-                        (src_disk_format, disk_format, blk_source, dist_img))
+            disk_cmd = ("qemu-img convert -f %s -O %s %s %s" %
+                        (src_disk_format, disk_format, blk_source, dist_path))
         else:
             # create another disk without convert
-            disk_cmd = "qemu-img create -f %s /mnt/%s 10M" % (src_disk_format,
-                                                              dist_img)
-
-        # Mount the gluster disk and create the image.
-        process.run("mount -t glusterfs %s:%s /mnt; %s; umount /mnt"
-                    % (host_ip, vol_name, disk_cmd), shell=True)
+            disk_cmd = "qemu-img create -f %s %s 10M" % (src_disk_format,
+                                                         dist_path)
+        process.run(disk_cmd)
 
         disk_params_src = {'source_protocol': disk_src_protocol,
                            'source_name': "%s/%s" % (vol_name, dist_img),
@@ -2476,12 +2633,12 @@ def set_vm_disk(vm, params, tmp_dir=None, test=None):
         dist_img = params.get("source_dist_img", "nfs-img")
 
         # Convert first disk to gluster disk path
-        disk_cmd = ("qemu-img convert -f %s -O %s %s %s/%s" %
+        disk_cmd = ("qemu-img convert -f %s -O %s %s %s" %
                     (src_disk_format, disk_format,
-                     blk_source, exp_path, dist_img))
+                     blk_source, os.path.join(exp_path, dist_img)))
         process.run(disk_cmd, ignore_status=False)
 
-        src_file_path = "%s/%s" % (mnt_path, dist_img)
+        src_file_path = os.path.join(mnt_path, dist_img)
         disk_params_src = {'source_file': src_file_path}
         params["source_file"] = src_file_path
         src_file_list.append(src_file_path)
@@ -2510,11 +2667,14 @@ def set_vm_disk(vm, params, tmp_dir=None, test=None):
             blk_source = disk_src_name
         disk_params_src = {'source_file': blk_source}
 
-    # Delete disk elements
-    disks = vmxml.get_devices(device_type="disk")
-    for disk_ in disks:
-        if disk_.target['dev'] == disk_target:
-            vmxml.del_device(disk_)
+    # Delete disk elements, del_device()/add_device() would rebuild the
+    # whole device list for every call, so edit one list and set it once
+    devices = vmxml.get_devices()
+    for index in reversed(range(len(devices))):
+        device = devices[index]
+        if (device.device_tag == 'disk' and
+                device.target['dev'] == disk_target):
+            del devices[index]
 
     # New disk xml
     new_disk = disk.Disk(type_name=disk_type)
@@ -2523,14 +2683,19 @@ def set_vm_disk(vm, params, tmp_dir=None, test=None):
     disk_xml = create_disk_xml(disk_params)
     new_disk.xml = disk_xml
     # Add new disk xml and redefine vm
-    vmxml.add_device(new_disk)
+    devices.append(new_disk)
+    vmxml.set_devices(devices)
 
     # Set domain options
     dom_iothreads = params.get("dom_iothreads")
     if dom_iothreads:
         vmxml.iothreads = int(dom_iothreads)
-    logging.debug("The vm xml now is: %s" % vmxml.xmltreefile)
-    vmxml.sync()
+    logging.debug("The vm xml now is: %s", vmxml.xmltreefile)
+    # The domain is shut off, so defining the new xml over the existing
+    # one is enough, no need for sync()'s backup dump and undefine
+    if not vmxml.define():
+        raise xcepts.LibvirtXMLError("Failed to define %s from xml:\n%s"
+                                     % (vm.name, vmxml.xmltreefile))
     vm.start()
 
 
@@ -2567,10 +2732,7 @@ def device_exists(vm, target_dev):
     """
     Check if given target device exists on vm.
     """
-    targets = list(vm.get_blk_devices().keys())
-    if target_dev in targets:
-        return True
-    return False
+    return target_dev in vm.get_blk_devices()
 
 
 def create_local_disk(disk_type, path=None,
@@ -2578,8 +2740,8 @@ def create_local_disk(disk_type, path=None,
                       vgname=None, lvname=None):
     if disk_type != "lvm" and path is None:
         raise exceptions.TestError("Path is needed for creating local disk")
-    if path:
-        process.run("mkdir -p %s" % os.path.dirname(path))
+    if path and os.path.dirname(path):
+        _ensure_dir(os.path.dirname(path))
     try:
         size = str(float(size)) + "G"
     except ValueError:
@@ -2588,7 +2750,8 @@ def create_local_disk(disk_type, path=None,
     if disk_type == "file":
         cmd = "qemu-img create -f %s %s %s" % (disk_format, path, size)
     elif disk_type == "floppy":
-        cmd = "dd if=/dev/zero of=%s count=1024 bs=1024" % path
+        # Sparse 1M image, no zeroes written through the page cache
+        cmd = "qemu-img create -f raw %s 1M" % path
     elif disk_type == "iso":
         cmd = "mkisofs -o %s /root/*.*" % path
     elif disk_type == "lvm":
@@ -2610,8 +2773,7 @@ def delete_local_disk(disk_type, path=None,
             raise exceptions.TestError(
                 "Path is needed for deleting local disk")
         else:
-            cmd = "rm -f %s" % path
-            process.run(cmd, ignore_status=True)
+            _remove_files([path])
     elif disk_type == "lvm":
         if vgname is None or lvname is None:
             raise exceptions.TestError("Both VG name and LV name needed")
@@ -2639,11 +2801,13 @@ def create_scsi_disk(scsi_option, scsi_size="2048"):
             linux_modules.unload_module("scsi_debug")
         linux_modules.load_module("scsi_debug dev_size_mb=%s %s" %
                                   (scsi_size, scsi_option))
-        # Get the scsi device name
-        scsi_disk = process.run("lsscsi|grep scsi_debug|"
-                                "awk '{print $6}'",
-                                shell=True).stdout.strip()
-        logging.info("scsi disk: %s" % scsi_disk)
+        # Get the scsi device name, the 6th column of its lsscsi line
+        scsi_disk = ""
+        for line in process.run("lsscsi").stdout.splitlines():
+            if "scsi_debug" in line:
+                scsi_disk = line.split()[5]
+                break
+        logging.info("scsi disk: %s", scsi_disk)
         return scsi_disk
     except Exception as e:
         logging.error(str(e))
@@ -2678,20 +2842,23 @@ def set_controller_multifunction(vm_name, controller_type='scsi'):
         domain = address_attrs['domain']
         bus = address_attrs['bus']
         slot = address_attrs['slot']
+        # Serialize the source controller once for all its functions
+        controller_xml = str(e_controller.xmltreefile)
         all_funcs = ["0x0", "0x1", "0x2", "0x3", "0x4", "0x5", "0x6"]
         for func in all_funcs:
             key = "%s:%s:%s:%s" % (domain, bus, slot, func)
+            # Expand controller to all functions with multifunction
+            if key in expanded_controllers:
+                continue
             address_attrs['function'] = func
             # Create a new controller instance
             new_controller = controller.Controller(controller_type)
-            new_controller.xml = str(xml_utils.XMLTreeFile(e_controller.xml))
+            new_controller.xml = controller_xml
             new_controller.index = index
             new_controller.address = new_controller.new_controller_address(
                 attrs=address_attrs)
-            # Expand controller to all functions with multifunction
-            if key not in list(expanded_controllers.keys()):
-                expanded_controllers[key] = new_controller
-                index += 1
+            expanded_controllers[key] = new_controller
+            index += 1
 
     logging.debug("Expanded controllers: %s", list(expanded_controllers.values()))
     vmxml.del_controller(controller_type)
@@ -2699,6 +2866,30 @@ def set_controller_multifunction(vm_name, controller_type='scsi'):
     vmxml.sync()
 
 
+def _generate_disks_index(count, target="virtio"):
+    """
+    Generate disk target names, named like the kernel does:
+    vda ... vdz, vdaa ... vdaz, vdba ... vdzz, vdaaa ...
+
+    :param count: Number of targets to generate
+    :param target: Disk bus, one of 'virtio', 'scsi' and 'ide'
+    :return: List of target names
+    """
+    prefixes = {"virtio": "vd", "scsi": "sd", "ide": "hd"}
+    if target not in prefixes:
+        raise exceptions.TestError("Unsupported disk target %s" % target)
+    target_list = []
+    for index in range(count):
+        # Bijective base-26: 0 -> 'a', 25 -> 'z', 26 -> 'aa'
+        suffix = ""
+        num = index + 1
+        while num:
+            num, rem = divmod(num - 1, 26)
+            suffix = chr(ord('a') + rem) + suffix
+        target_list.append(prefixes[target] + suffix)
+    return target_list
+
+
 def attach_disks(vm, path, vgname, params):
     """
     Attach multiple disks.According parameter disk_type in params,
@@ -2717,85 +2908,79 @@ def attach_disks(vm, path, vgname, params):
     # Whether attaching device with --config
     attach_config = "yes" == params.get("attach_disk_config", "yes")
 
-    def generate_disks_index(count, target="virtio"):
-        # Created disks' index
-        target_list = []
-        # Used to flag progression
-        index = 0
-        # A list to maintain prefix for generating device
-        # ['a','b','c'] means prefix abc
-        prefix_list = []
-        while count > 0:
-            # Out of range for current prefix_list
-            if (index / 26) > 0:
-                # Update prefix_list to expand disks, such as [] -> ['a'],
-                # ['z'] -> ['a', 'a'], ['z', 'z'] -> ['a', 'a', 'a']
-                prefix_index = len(prefix_list)
-                if prefix_index == 0:
-                    prefix_list.append('a')
-                # Append a new prefix to list, then update pre-'z' in list
-                # to 'a' to keep the progression 1
-                while prefix_index > 0:
-                    prefix_index -= 1
-                    prefix_cur = prefix_list[prefix_index]
-                    if prefix_cur == 'z':
-                        prefix_list[prefix_index] = 'a'
-                        # All prefix in prefix_list are 'z',
-                        # it's time to expand it.
-                        if prefix_index == 0:
-                            prefix_list.append('a')
-                    else:
-                        # For whole prefix_list, progression is 1
-                        prefix_list[prefix_index] = chr(ord(prefix_cur) + 1)
-                        break
-                # Reset for another iteration
-                index = 0
-            prefix = "".join(prefix_list)
-            suffix_index = index % 26
-            suffix = chr(ord('a') + suffix_index)
-            index += 1
-            count -= 1
-
-            # Generate device target according to driver type
-            if target == "virtio":
-                target_dev = "vd%s" % (prefix + suffix)
-            elif target == "scsi":
-                target_dev = "sd%s" % (prefix + suffix)
-            elif target == "ide":
-                target_dev = "hd%s" % (prefix + suffix)
-            target_list.append(target_dev)
-        return target_list
-
-    target_list = generate_disks_index(disks_count, disk_target)
+    target_list = _generate_disks_index(disks_count, disk_target)
+
+    # Prepare controller for special disks like virtio-scsi
+    # Open multifunction to add more controller for disks(150 or more)
+    # All controllers are expanded at once, so one call serves every disk
+    if multifunction_on and target_list:
+        set_controller_multifunction(vm.name, disk_target)
+
+    # With --config all disks go into one define of the inactive xml,
+    # instead of a detach-disk plus attach-device pair per disk
+    vmxml = None
+    if attach_config:
+        vmxml = vm_xml.VMXML.new_from_inactive_dumpxml(vm.name)
+    new_disks = []
+
+    # Do not attach if it does already exist
+    existing_targets = vm.get_blk_devices()
+    new_targets = [target_dev for target_dev in target_list
+                   if target_dev not in existing_targets]
+    disk_dir = os.path.dirname(path)
+    create_args = []
+    for target_dev in new_targets:
+        device_name = "%s_%s" % (target_dev, vm.name)
+        disk_path = os.path.join(disk_dir, device_name)
+        create_args.append((disk_type, disk_path, disk_size, disk_format,
+                            vgname, device_name))
+    if disk_type == "lvm":
+        disk_paths = [create_local_disk(*args) for args in create_args]
+    else:
+        # Image files do not depend on each other, create them concurrently
+        disk_paths = []
+        step = _MAX_PARALLEL_DISK_CREATE
+        for i in range(0, len(create_args), step):
+            disk_paths.extend(utils_misc.parallel(
+                [(create_local_disk, args)
+                 for args in create_args[i:i + step]]))
 
     # A dict include disks information: source file and size
     added_disks = {}
-    for target_dev in target_list:
-        # Do not attach if it does already exist
-        if device_exists(vm, target_dev):
-            continue
-
-        # Prepare controller for special disks like virtio-scsi
-        # Open multifunction to add more controller for disks(150 or more)
-        if multifunction_on:
-            set_controller_multifunction(vm.name, disk_target)
-
+    device_type = params.get("device_type", "disk")
+    for target_dev, disk_path in zip(new_targets, disk_paths):
         disk_params = {}
         disk_params['type_name'] = disk_type
         disk_params['target_dev'] = target_dev
         disk_params['target_bus'] = disk_target
-        disk_params['device_type'] = params.get("device_type", "disk")
-        device_name = "%s_%s" % (target_dev, vm.name)
-        disk_path = os.path.join(os.path.dirname(path), device_name)
-        disk_path = create_local_disk(disk_type, disk_path,
-                                      disk_size, disk_format,
-                                      vgname, device_name)
+        disk_params['device_type'] = device_type
         added_disks[disk_path] = disk_size
+        if vmxml is not None:
+            disk_params['source_file'] = disk_path
+            new_disk = disk.Disk(type_name=disk_type)
+            new_disk.xml = create_disk_xml(disk_params)
+            new_disks.append(new_disk)
+            continue
         result = attach_additional_device(vm.name, target_dev, disk_path,
                                           disk_params, attach_config)
         if result.exit_status:
             raise exceptions.TestFail("Attach device %s failed."
                                       % target_dev)
+
+    if new_disks:
+        # Drop disks defined on the same targets, as detach-disk would do,
+        # editing one device list and setting it once
+        devices = vmxml.get_devices()
+        for index in reversed(range(len(devices))):
+            device = devices[index]
+            if (device.device_tag == 'disk' and
+                    device.target['dev'] in new_targets):
+                del devices[index]
+        devices.extend(new_disks)
+        vmxml.set_devices(devices)
+        if not vmxml.define():
+            raise exceptions.TestFail("Attach devices %s failed."
+                                      % ", ".join(new_targets))
     logging.debug("New VM XML:\n%s", vm.get_xml())
     return added_disks
 
@@ -2870,7 +3055,7 @@ def connect_libvirtd(uri, read_only="", virsh_cmd="list", auth_user=None,
                                               uri, virsh_cmd, vm_name)
     # allow specific user to run virsh command
     if su_user != "":
-        command = "su %s -c '%s'" % (su_user, command)
+        command = "su %s -c %s" % (su_user, shlex_quote(command))
 
     logging.info("Execute %s", command)
     # setup shell session
@@ -2878,11 +3063,11 @@ def connect_libvirtd(uri, read_only="", virsh_cmd="list", auth_user=None,
 
     try:
         # requires access authentication
+        # Extra patterns are taken once, in the order they are matched
+        extra_patterns = list(patterns_extra_dict or {})
         match_list = [patterns_yes_no, patterns_auth_name_comm,
                       patterns_auth_name_xen, patterns_auth_pwd,
-                      patterns_virsh_cmd]
-        if patterns_extra_dict:
-            match_list = match_list + list(patterns_extra_dict.keys())
+                      patterns_virsh_cmd] + extra_patterns
         patterns_list_len = len(match_list)
 
         while True:
@@ -2905,9 +3090,7 @@ def connect_libvirtd(uri, read_only="", virsh_cmd="list", auth_user=None,
                 logging.info("Expected output of virsh command: <%s>", text)
                 break
             if (patterns_list_len > 5):
-                extra_len = len(patterns_extra_dict)
-                index_in_extra_dict = match + extra_len
-                key = list(patterns_extra_dict.keys())[index_in_extra_dict]
+                key = extra_patterns[match + len(extra_patterns)]
                 value = patterns_extra_dict.get(key, "")
                 logging.info("Matched '%s', details:<%s>", key, text)
                 session.sendline(value)
@@ -2931,14 +3114,13 @@ def get_all_vol_paths():
     """
     vol_path = []
     sp = libvirt_storage.StoragePool()
-    for pool_name in list(sp.list_pools().keys()):
-        if sp.list_pools()[pool_name]['State'] != "active":
+    for pool_name, pool_details in six.iteritems(sp.list_pools()):
+        if pool_details['State'] != "active":
             logging.warning(
-                "Inactive pool '%s' cannot be processed" % pool_name)
+                "Inactive pool '%s' cannot be processed", pool_name)
             continue
         pv = libvirt_storage.PoolVolume(pool_name)
-        for path in list(pv.list_volumes().values()):
-            vol_path.append(path)
+        vol_path.extend(pv.list_volumes().values())
     return set(vol_path)
 
 
@@ -2956,7 +3138,7 @@ def do_migration(vm_name, uri, extra, auth_pwd, auth_user="root",
                                                 vm_name, options, uri)
     # allow specific user to run virsh command
     if su_user != "":
-        command = "su %s -c '%s'" % (su_user, command)
+        command = "su %s -c %s" % (su_user, shlex_quote(command))
 
     logging.info("Execute %s", command)
     # setup shell session
@@ -2966,9 +3148,16 @@ def do_migration(vm_name, uri, extra, auth_pwd, auth_user="root",
         # requires access authentication
         match_list = [patterns_yes_no, patterns_auth_name,
                       patterns_auth_pwd, virsh_patterns]
+        # timeout bounds the whole exchange, a peer repeating its
+        # prompts must not keep the loop going forever
+        deadline = time.time() + timeout
         while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise aexpect.ExpectTimeoutError(match_list,
+                                                 session.get_output())
             match, text = session.read_until_any_line_matches(match_list,
-                                                              timeout=timeout,
+                                                              timeout=remaining,
                                                               internal_timeout=1)
             if match == -4:
                 logging.info("Matched 'yes/no', details: <%s>", text)
@@ -2985,34 +3174,38 @@ def do_migration(vm_name, uri, extra, auth_pwd, auth_user="root",
             else:
                 logging.error("The real prompt text: <%s>", text)
                 break
-        log = session.get_output()
-        session.close()
-        return (True, log)
+        return (True, session.get_output())
 
     except (aexpect.ShellError, aexpect.ExpectError) as details:
         log = session.get_output()
-        session.close()
         logging.error("Failed to migrate %s: %s\n%s", vm_name, details, log)
         return (False, log)
+    finally:
+        session.close()
 
 
 def update_vm_disk_source(vm_name, disk_source_path,
                           disk_image_name="",
-                          source_type="file"):
+                          source_type="file", vmxml=None):
     """
     Update disk source path of the VM
 
     :param source_type: it may be 'dev' or 'file' type, which is default
+    :param vmxml: VMXML of the VM if the caller already has it, it is
+                  dumped from vm_name otherwise
     """
     if not os.path.isdir(disk_source_path):
         logging.error("Require disk source path!!")
         return False
 
     # Prepare to update VM first disk source file
-    vmxml = vm_xml.VMXML.new_from_dumpxml(vm_name)
-    devices = vmxml.devices
-    disk_index = devices.index(devices.by_device_tag('disk')[0])
-    disks = devices[disk_index]
+    if vmxml is None:
+        vmxml = vm_xml.VMXML.new_from_dumpxml(vm_name)
+    # Only the first disk is rebuilt, the other devices stay untouched
+    devices_element = vmxml.xmltreefile.find('devices')
+    disk_element = devices_element.find('disk')
+    disks = disk.Disk.new_from_element(disk_element,
+                                       virsh_instance=vmxml.virsh)
     # Generate a disk image name if it doesn't exist
     if not disk_image_name:
         disk_source = disks.source.get_attrs().get(source_type)
@@ -3026,8 +3219,11 @@ def update_vm_disk_source(vm_name, disk_source_path,
     try:
         disks.source = disks.new_disk_source(**{'attrs': {'%s' % source_type:
                                                           "%s" % new_disk_source}})
-        # SYNC VM XML change
-        vmxml.devices = devices
+        # Put the updated disk back at its position and SYNC VM XML change
+        position = list(devices_element).index(disk_element)
+        devices_element.remove(disk_element)
+        devices_element.insert(position, disks.xmltreefile.getroot())
+        vmxml.xmltreefile.write()
         logging.debug("The new VM XML:\n%s", vmxml.xmltreefile)
         vmxml.sync()
         return True
@@ -3067,8 +3263,8 @@ def hotplug_domain_vcpu(domain, count, by_virsh=True, hotplug=True):
             # }
             # so, the caller should check the result.
         # hot-plug/hot-plug the CPU has maximal ID
-        params = (cpu_opt, (count - 1))
-        cmd = '{\"execute\":\"%s\",\"arguments\":{\"id\":%d}}' % params
+        cmd = json.dumps({"execute": cpu_opt, "arguments": {"id": count - 1}},
+                         separators=(",", ":"))
         result = virsh.qemu_monitor_command(domain,
                                             cmd,
                                             "--pretty",
@@ -3088,8 +3284,9 @@ def exec_virsh_edit(source, edit_cmd, connect_uri="qemu:///system"):
     session = aexpect.ShellSession("sudo -s")
     try:
         session.sendline("virsh -c %s edit %s" % (connect_uri, source))
-        for cmd in edit_cmd:
-            session.sendline(cmd)
+        # Queue all edit commands for the editor in a single write
+        if edit_cmd:
+            session.sendline(session.linesep.join(edit_cmd))
         session.send('\x1b')
         session.send('ZZ')
         remote.handle_prompts(session, None, None, r"[\#\$]\s*$", debug=True)
@@ -3101,22 +3298,24 @@ def exec_virsh_edit(source, edit_cmd, connect_uri="qemu:///system"):
         return False
 
 
-def new_disk_vol_name(pool_name):
+def new_disk_vol_name(pool_name, poolxml=None):
     """
     According to BZ#1138523, the new volume name must be the next
     created partition(sdb1, etc.), so we need to inspect the original
     partitions of the disk then count the new partition number.
 
     :param pool_name: Disk pool name
+    :param poolxml: PoolXML of the pool if the caller already has it,
+                    it is dumped from pool_name otherwise
     :return: New volume name or none
     """
-    poolxml = pool_xml.PoolXML.new_from_dumpxml(pool_name)
-    if poolxml.get_type(pool_name) != "disk":
+    if poolxml is None:
+        poolxml = pool_xml.PoolXML.new_from_dumpxml(pool_name)
+    if poolxml.pool_type != "disk":
         logging.error("This is not a disk pool")
         return None
     disk = poolxml.get_source().device_path[5:]
-    part_num = len(list(filter(lambda s: s.startswith(disk),
-                               get_parts_list())))
+    part_num = sum(1 for part in get_parts_list() if part.startswith(disk))
     return disk + str(part_num)
 
 
@@ -3131,13 +3330,11 @@ def update_polkit_rule(params, pattern, new_value):
     polkit = test_setup.LibvirtPolkitConfig(params)
     polkit_rules_path = polkit.polkit_rules_path
     try:
-        polkit_f = open(polkit_rules_path, 'r+')
-        rule = polkit_f.read()
+        with open(polkit_rules_path) as polkit_f:
+            rule = polkit_f.read()
         new_rule = re.sub(pattern, new_value, rule)
-        polkit_f.seek(0)
-        polkit_f.truncate()
-        polkit_f.write(new_rule)
-        polkit_f.close()
+        with open(polkit_rules_path, 'w') as polkit_f:
+            polkit_f.write(new_rule)
         logging.debug("New polkit config rule is:\n%s", new_rule)
         polkit.polkitd.restart()
     except IOError as e:
@@ -3165,20 +3362,31 @@ def get_vol_list(pool_name, vol_check=True, timeout=5):
     if not vols:
         raise exceptions.TestError("No volume in pool %s" % pool_name)
 
-    # Check volume
-    for vol_path in six.itervalues(vols):
-        if not utils_misc.wait_for(lambda: os.path.exists(vol_path), timeout,
-                                   text='Waiting for %s show up' % vol_path):
-            raise exceptions.TestError("Volume path %s not exist" % vol_path)
+    # Check volume, all paths share one wait as they show up together
+    missing = list(six.itervalues(vols))
+
+    def _all_vol_paths_exist():
+        missing[:] = [path for path in missing if not os.path.exists(path)]
+        return not missing
+
+    if not utils_misc.wait_for(_all_vol_paths_exist, timeout,
+                               text='Waiting for volume paths show up'):
+        raise exceptions.TestError("Volume path %s not exist"
+                                   % ", ".join(missing))
 
     return vols
 
 
-def get_iothreadsinfo(vm_name, options=None):
+def get_iothreadsinfo(vm_name, options=None, only=None, cache_ms=0):
     """
     Parse domain iothreadinfo.
 
     :param vm_name: Domain name
+    :param only: IOThread ID, if given stop at its row and return a dict
+                 with that iothread only (empty if there is no such one)
+    :param cache_ms: If not 0, reuse the last full result for the same
+                     domain and options when it is younger than this many
+                     milliseconds. See clear_iothreadsinfo_cache().
     :return: The dict of domain iothreads
 
     ::
@@ -3195,19 +3403,50 @@ def get_iothreadsinfo(vm_name, options=None):
     ::
         {'2': '3', '1': '0-4', '4': '0-7', '3': '0-7'}
     """
+    key = (vm_name, options)
+    if cache_ms and key in _IOTHREADS_INFO_CACHE:
+        stamp, cached = _IOTHREADS_INFO_CACHE[key]
+        if time.time() - stamp < cache_ms / 1000.0:
+            if only is None:
+                return dict(cached)
+            only = str(only)
+            return {only: cached[only]} if only in cached else {}
+
     info_dict = {}
     ret = virsh.iothreadinfo(vm_name, options,
                              debug=True, ignore_status=True)
     if ret.exit_status:
         logging.warning(ret.stderr.strip())
         return info_dict
-    info_list = re.findall(r"(\d+) +(\S+)", ret.stdout, re.M)
-    for info in info_list:
-        info_dict[info[0]] = info[1]
+    for line in ret.stdout.splitlines():
+        # Rows are "<IOThread ID> <CPU Affinity>", headers have no number
+        parts = line.split(None, 2)
+        if len(parts) < 2 or not parts[0].isdigit():
+            continue
+        if only is None:
+            info_dict[parts[0]] = parts[1]
+        elif parts[0] == str(only):
+            return {parts[0]: parts[1]}
 
+    if only is None:
+        _IOTHREADS_INFO_CACHE[key] = (time.time(), dict(info_dict))
     return info_dict
 
 
+def clear_iothreadsinfo_cache(vm_name=None):
+    """
+    Drop results remembered by get_iothreadsinfo.
+
+    Call it after adding, deleting or pinning iothreads when callers use
+    cache_ms.
+
+    :param vm_name: Domain name, all domains if None
+    """
+    for key in list(_IOTHREADS_INFO_CACHE):
+        if vm_name is None or key[0] == vm_name:
+            del _IOTHREADS_INFO_CACHE[key]
+
+
 def virsh_cmd_has_option(cmd, option, raise_skip=True):
     """
     Check whether virsh command support given option.
@@ -3217,9 +3456,12 @@ def virsh_cmd_has_option(cmd, option, raise_skip=True):
     :raise_skip: Whether raise exception when option not find
     :return: True/False or raise TestSkipError
     """
-    found = False
-    if virsh.has_command_help_match(cmd, option):
-        found = True
+    # The help text does not change during a run, ask virsh only once
+    key = (cmd, option)
+    if key not in _VIRSH_CMD_OPTIONS:
+        _VIRSH_CMD_OPTIONS[key] = bool(virsh.has_command_help_match(cmd,
+                                                                    option))
+    found = _VIRSH_CMD_OPTIONS[key]
     msg = "command '%s' has option '%s': %s" % (cmd, option, str(found))
     if not found and raise_skip:
         raise exceptions.TestSkipError(msg)
@@ -3228,6 +3470,16 @@ def virsh_cmd_has_option(cmd, option, raise_skip=True):
         return found
 
 
+def clear_virsh_cmd_option_cache():
+    """
+    Drop results remembered by virsh_cmd_has_option.
+
+    Call it when the virsh binary may have changed, e.g. after a libvirt
+    upgrade.
+    """
+    _VIRSH_CMD_OPTIONS.clear()
+
+
 def create_secret(params):
     """
     Create a secret with 'virsh secret-define'
@@ -3244,16 +3496,14 @@ def create_secret(params):
     sec_name = params.get("sec_name", "secret_name")
     sec_target = params.get("sec_target", "secret_target")
 
-    supporting_usage_types = ['volume', 'ceph', 'iscsi', 'tls']
-    if sec_usage_type not in supporting_usage_types:
+    if sec_usage_type not in _SECRET_USAGE_TYPES:
         raise exceptions.TestError("Supporting secret usage types are: %s" %
-                                   supporting_usage_types)
+                                   list(_SECRET_USAGE_TYPES))
 
     # prepare secret xml
     sec_xml = secret_xml.SecretXML("no", "yes")
     # set common attributes
     sec_xml.description = sec_desc
-    sec_xml.usage = sec_usage_type
     if sec_ephemeral:
         sec_xml.secret_ephmeral = "yes"
     if sec_private:
@@ -3262,21 +3512,21 @@ def create_secret(params):
         sec_xml.uuid = sec_uuid
     sec_xml.usage = sec_usage_type
     # set specific attributes for different usage type
-    if sec_usage_type in ['volume']:
+    if sec_usage_type == 'volume':
         sec_xml.volume = sec_volume
-    if sec_usage_type in ['ceph', 'tls']:
+    elif sec_usage_type in ('ceph', 'tls'):
         sec_xml.usage_name = sec_name
-    if sec_usage_type in ['iscsi']:
+    elif sec_usage_type == 'iscsi':
         sec_xml.target = sec_target
     sec_xml.xmltreefile.write()
-    logging.debug("The secret xml is: %s" % sec_xml)
+    logging.debug("The secret xml is: %s", sec_xml)
 
     # define the secret and get its uuid
     ret = virsh.secret_define(sec_xml.xml)
     check_exit_status(ret)
     try:
-        sec_uuid = re.findall(r".+\S+(\ +\S+)\ +.+\S+",
-                              ret.stdout)[0].lstrip()
+        # virsh prints: "Secret <uuid> created"
+        sec_uuid = ret.stdout.split()[1]
     except IndexError:
         raise exceptions.TestError("Fail to get newly created secret uuid")
 